@@ -0,0 +1,130 @@
+"""Running test-interval statistics behind the adherence score and test reminders.
+
+The sidebar, Home page, tracker, PDF report, JSON export and summary all
+show the adherence score, often several in one rerun, and each call used
+to sort every risk_history date and diff them again. AdherenceTracker
+keeps the interval statistics instead. It lives in st.session_state and
+catches up with the history by ColumnarHistory.version, the way
+TrackerViews does. Each new test is one interval more: the count, sum and
+longest gap are updated in constant time, and the interval goes onto a
+pair of heaps that keep the median at hand (O(log n)).
+
+Tests are usually recorded in date order. A test dated before an earlier
+row (already folded in or in the same batch) makes the tracker rebuild
+from the sorted dates once; a different history object (patient switch,
+restore) resets it.
+"""
+import datetime
+import heapq
+
+import numpy as np
+
+# Recommended days between tests; the next test is due this long after the latest one
+TEST_INTERVAL_DAYS = 90
+
+# Adherence score for a mean interval up to each limit (days); longer intervals score ADHERENCE_FLOOR
+ADHERENCE_BANDS = ((90, 100), (120, 80), (180, 60))
+ADHERENCE_FLOOR = 40
+
+
+class AdherenceTracker:
+    """Interval statistics of one risk history, kept up to date on append"""
+
+    def __init__(self):
+        self._reset(None)
+
+    def _reset(self, history):
+        self.history = history
+        self.size = 0
+        self.version = None
+        self.count = 0
+        self.first = None
+        self.last = None
+        self.interval_sum = 0
+        self.longest_gap = 0
+        # Max-heap (negated) of the lower half of the intervals and min-heap of the upper half
+        self._lower = []
+        self._upper = []
+
+    def update(self, history):
+        """Fold in rows appended to history since the last call; returns self"""
+        if history is not self.history or history.size < self.size:
+            self._reset(history)
+        if self.version != history.version:
+            dates = history.column('date')
+            new = dates[self.size:]
+            back_dated = len(new) and ((self.last is not None and new.min() < self.last)
+                                       or np.any(np.diff(new) < np.timedelta64(0)))
+            if back_dated:
+                # A test dated before one already folded in: start over from the sorted dates
+                self._reset(history)
+                new = np.sort(dates)
+            for date in new:
+                self._add(date)
+            self.size = history.size
+            self.version = history.version
+        return self
+
+    def _add(self, date):
+        self.count += 1
+        if self.last is None:
+            self.first = self.last = date
+            return
+        interval = int((date - self.last) // np.timedelta64(1, 'D'))
+        self.last = date
+        self.interval_sum += interval
+        self.longest_gap = max(self.longest_gap, interval)
+        if self._lower and interval > -self._lower[0]:
+            heapq.heappush(self._upper, interval)
+        else:
+            heapq.heappush(self._lower, -interval)
+        # Keep the lower half equal to or one larger than the upper half
+        if len(self._lower) > len(self._upper) + 1:
+            heapq.heappush(self._upper, -heapq.heappop(self._lower))
+        elif len(self._upper) > len(self._lower):
+            heapq.heappush(self._lower, -heapq.heappop(self._upper))
+
+    @property
+    def intervals(self):
+        return max(0, self.count - 1)
+
+    @property
+    def mean_interval(self):
+        """Mean whole days between consecutive tests, or None with fewer than two tests"""
+        return self.interval_sum / self.intervals if self.intervals else None
+
+    @property
+    def median_interval(self):
+        if not self.intervals:
+            return None
+        if len(self._lower) > len(self._upper):
+            return float(-self._lower[0])
+        return (-self._lower[0] + self._upper[0]) / 2
+
+    @property
+    def last_test(self):
+        """Date of the latest test, or None"""
+        return None if self.last is None else self.last.astype('datetime64[D]').astype(datetime.date)
+
+    @property
+    def next_due(self):
+        """Date the next test is due, TEST_INTERVAL_DAYS after the latest one"""
+        last_test = self.last_test
+        return None if last_test is None else last_test + datetime.timedelta(days=TEST_INTERVAL_DAYS)
+
+    def days_since_last(self, today=None):
+        last_test = self.last_test
+        if last_test is None:
+            return None
+        return ((today or datetime.date.today()) - last_test).days
+
+    @property
+    def score(self):
+        """Adherence score (0-100) from the mean interval; 0 with fewer than two tests"""
+        mean = self.mean_interval
+        if mean is None:
+            return 0
+        for limit, score in ADHERENCE_BANDS:
+            if mean <= limit:
+                return score
+        return ADHERENCE_FLOOR
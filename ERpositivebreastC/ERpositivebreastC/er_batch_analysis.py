@@ -0,0 +1,415 @@
+"""Headless batch analysis of LFA test strip images.
+
+Runs the same analyze_er_image_with_confidence code path as the Streamlit app
+over a directory or manifest of images, fanned out across a process pool, and
+streams one result row per image to CSV, NDJSON or SQLite as each finishes.
+
+Example:
+    python er_batch_analysis.py strips/ --output results.csv
+    python er_batch_analysis.py --manifest todays_strips.txt --output results.ndjson
+"""
+import argparse
+import concurrent.futures
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+from er_calibration import CalibrationProfileStore
+from er_image_analysis import (
+    ANALYSIS_BACKENDS,
+    ANALYSIS_MODES,
+    analyze_er_image_with_confidence,
+    get_backend_report,
+    get_multires_report,
+    set_active_backend,
+)
+from er_image_ingest import analysis_max_pixels, decode_bounded_image, load_analysis_image
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+RESULT_FIELDS = [
+    'path',
+    'er_status',
+    'risk_level',
+    'risk_score',
+    'confidence',
+    'er_intensity',
+    'avg_red_value',
+    'color_saturation',
+    'color_description',
+    'roi',
+    'resolution_level',
+    'tc_ratio',
+    'decode_ms',
+    'analyze_ms',
+    'peak_mem_mb',
+    'error'
+]
+
+# Per-worker settings, set once by _init_worker
+_worker_calibration_ref = None
+_worker_calibration_profile = None
+_worker_detect_roi = True
+_worker_mode = "exact"
+_worker_max_memory_mb = None
+_worker_max_pixels = None
+
+
+def collect_image_paths(directory=None, manifest=None):
+    """Collect image paths from a directory tree and/or a manifest file"""
+    paths = []
+
+    if directory:
+        for root, _, files in os.walk(directory):
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.append(os.path.join(root, name))
+
+    if manifest:
+        # One path per line; relative paths are resolved against the manifest
+        base_dir = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                paths.append(line if os.path.isabs(line) else os.path.join(base_dir, line))
+
+    return paths
+
+
+def _init_worker(calibration_path, trace_memory=False, detect_roi=True, mode="exact",
+                 calibration_profile=None, profiles_path=None, max_memory_mb=None, max_pixels=None,
+                 backend=None):
+    """Load the calibration reference or profile once per worker process"""
+    global _worker_calibration_ref, _worker_calibration_profile, _worker_detect_roi, _worker_mode
+    global _worker_max_memory_mb, _worker_max_pixels
+    _worker_max_memory_mb = max_memory_mb
+    _worker_max_pixels = max_pixels
+    _worker_detect_roi = detect_roi
+    _worker_mode = mode
+    if backend:
+        # Chosen once by the parent, so workers skip their own selection benchmark
+        set_active_backend(backend, reason="batch")
+    if calibration_path:
+        _worker_calibration_ref = Image.open(calibration_path)
+        _worker_calibration_ref.load()
+    if calibration_profile:
+        store = CalibrationProfileStore(profiles_path) if profiles_path else CalibrationProfileStore()
+        _worker_calibration_profile = store.get(calibration_profile)
+    if trace_memory:
+        # numpy and OpenCV's numpy-backed outputs report their buffers to tracemalloc
+        tracemalloc.start()
+
+
+def _to_builtin(value):
+    """Convert numpy scalars to plain Python values for serialization"""
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def analyze_image_file(path):
+    """Analyze one image file and return a flat result row"""
+    row = {'path': path, 'error': ''}
+
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+
+    try:
+        start = time.perf_counter()
+        # Decoded as the app decodes for the mode (working resolution; up to TILED_MAX_PIXELS when tiled)
+        max_pixels = analysis_max_pixels(_worker_mode, _worker_max_pixels)
+        if _worker_mode == "tiled":
+            image = decode_bounded_image(path, max_pixels)
+        else:
+            image = load_analysis_image(path, max_pixels)
+        decoded = time.perf_counter()
+
+        # Same call the Single/Multi-Image analyzers make
+        er_results = analyze_er_image_with_confidence(image, _worker_calibration_ref,
+                                                      detect_roi=_worker_detect_roi, mode=_worker_mode,
+                                                      calibration_profile=_worker_calibration_profile,
+                                                      max_memory_mb=_worker_max_memory_mb)
+        analyzed = time.perf_counter()
+    except Exception as e:
+        row['error'] = f"{type(e).__name__}: {e}"
+        return row
+
+    for key, value in er_results.items():
+        if key == 'roi':
+            row[key] = json.dumps(value) if value is not None else ''
+        elif key in RESULT_FIELDS:
+            row[key] = _to_builtin(value)
+    row['decode_ms'] = (decoded - start) * 1000
+    row['analyze_ms'] = (analyzed - decoded) * 1000
+    if _worker_mode == "multires":
+        # Cumulative counters for this worker; the parent keeps the latest per process
+        row['_multires'] = (os.getpid(), get_multires_report())
+    if tracemalloc.is_tracing():
+        row['peak_mem_mb'] = (tracemalloc.get_traced_memory()[1] - baseline) / (1024 * 1024)
+    return row
+
+
+class CsvResultWriter:
+    """Write result rows to a CSV file"""
+
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.DictWriter(self.file, fieldnames=RESULT_FIELDS, extrasaction='ignore')
+        self.writer.writeheader()
+
+    def write(self, row):
+        self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class NdjsonResultWriter:
+    """Write result rows as newline-delimited JSON"""
+
+    def __init__(self, path):
+        self.file = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8')
+
+    def write(self, row):
+        self.file.write(json.dumps({field: row.get(field) for field in RESULT_FIELDS}) + '\n')
+        self.file.flush()
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+class SqliteResultWriter:
+    """Write result rows to a SQLite table, committing in small batches"""
+
+    def __init__(self, path, table='batch_results', commit_every=100):
+        self.conn = sqlite3.connect(path)
+        self.table = table
+        self.commit_every = commit_every
+        self.pending = 0
+        columns = ', '.join(f"{field} {'TEXT' if field in ('path', 'er_status', 'risk_level', 'color_description', 'roi', 'error') else 'REAL'}"
+                            for field in RESULT_FIELDS)
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns})")
+        self.insert_sql = (f"INSERT INTO {table} ({', '.join(RESULT_FIELDS)}) "
+                           f"VALUES ({', '.join('?' for _ in RESULT_FIELDS)})")
+
+    def write(self, row):
+        self.conn.execute(self.insert_sql, [row.get(field) for field in RESULT_FIELDS])
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.conn.commit()
+            self.pending = 0
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def open_result_writer(path, output_format=None):
+    """Create a writer for the output path, inferring the format from its extension"""
+    if output_format is None:
+        ext = os.path.splitext(path)[1].lower()
+        output_format = {'.csv': 'csv', '.db': 'sqlite', '.sqlite': 'sqlite'}.get(ext, 'ndjson')
+
+    if output_format == 'csv':
+        return CsvResultWriter(path)
+    elif output_format == 'sqlite':
+        return SqliteResultWriter(path)
+    else:
+        return NdjsonResultWriter(path)
+
+
+def run_batch(paths, writer, workers=None, calibration_path=None, detect_roi=True, mode="exact",
+              calibration_profile=None, profiles_path=None, max_memory_mb=None, max_pixels=None,
+              backend=None, trace_memory=False, progress=None):
+    """Analyze paths on a process pool, streaming rows to writer as they finish.
+
+    backend pins the analysis backend; otherwise the parent selects one (or
+    applies ER_ANALYSIS_BACKEND) and every worker uses it. Returns a summary
+    dict with throughput, per-stage timings, the backend used, the
+    multi-resolution escalation report when mode="multires" and, when
+    trace_memory is set, the peak traced memory of any single image.
+    """
+    if backend:
+        set_active_backend(backend)
+    backend_report = get_backend_report()
+
+    workers = workers or os.cpu_count() or 1
+    # Keep a bounded number of tasks in flight so huge batches don't queue everything up front
+    max_in_flight = workers * 4
+
+    stage_totals = {'decode_ms': 0.0, 'analyze_ms': 0.0, 'write_ms': 0.0}
+    completed = 0
+    failed = 0
+    peak_mem_mb = None
+    multires_by_worker = {}
+    start = time.perf_counter()
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                initializer=_init_worker,
+                                                initargs=(calibration_path, trace_memory, detect_roi, mode,
+                                                          calibration_profile, profiles_path,
+                                                          max_memory_mb, max_pixels,
+                                                          backend_report['selected'])) as pool:
+        pending = set()
+        path_iter = iter(paths)
+
+        def submit_next():
+            for path in path_iter:
+                pending.add(pool.submit(analyze_image_file, path))
+                if len(pending) >= max_in_flight:
+                    break
+
+        submit_next()
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                row = future.result()
+
+                write_start = time.perf_counter()
+                writer.write(row)
+                stage_totals['write_ms'] += (time.perf_counter() - write_start) * 1000
+
+                completed += 1
+                if row['error']:
+                    failed += 1
+                else:
+                    stage_totals['decode_ms'] += row['decode_ms']
+                    stage_totals['analyze_ms'] += row['analyze_ms']
+                    if '_multires' in row:
+                        pid, report = row['_multires']
+                        multires_by_worker[pid] = report
+                    if 'peak_mem_mb' in row:
+                        peak_mem_mb = max(peak_mem_mb or 0.0, row['peak_mem_mb'])
+
+                if progress:
+                    progress(completed, len(paths))
+            submit_next()
+
+    elapsed = time.perf_counter() - start
+    succeeded = completed - failed
+
+    multires = None
+    if multires_by_worker:
+        reports = multires_by_worker.values()
+        analyses = sum(r['analyses'] for r in reports)
+        escalations = sum(r['escalations'] for r in reports)
+        multires = {
+            'analyses': analyses,
+            'escalations': escalations,
+            'escalation_rate': escalations / analyses if analyses else 0.0,
+            'estimated_saved_ms': sum(r['estimated_saved_ms'] for r in reports)
+        }
+
+    return {
+        'images': completed,
+        'failed': failed,
+        'workers': workers,
+        'wall_time_s': elapsed,
+        'images_per_s': completed / elapsed if elapsed > 0 else 0.0,
+        'peak_mem_mb': peak_mem_mb,
+        'backend': backend_report,
+        'multires': multires,
+        'stage_totals_ms': stage_totals,
+        'stage_means_ms': {
+            'decode_ms': stage_totals['decode_ms'] / succeeded if succeeded else 0.0,
+            'analyze_ms': stage_totals['analyze_ms'] / succeeded if succeeded else 0.0,
+            'write_ms': stage_totals['write_ms'] / completed if completed else 0.0
+        }
+    }
+
+
+def format_summary(summary):
+    """Format a run_batch summary for the terminal"""
+    lines = [
+        f"Images analyzed: {summary['images']} ({summary['failed']} failed) on {summary['workers']} workers",
+        f"Wall time: {summary['wall_time_s']:.2f}s",
+        f"Throughput: {summary['images_per_s']:.2f} images/s",
+        f"Analysis backend: {summary['backend']['selected']} ({summary['backend']['reason']})",
+        "Per-stage timings (total / mean per image):"
+    ]
+    for stage in ('decode_ms', 'analyze_ms', 'write_ms'):
+        name = stage.replace('_ms', '')
+        lines.append(f"  {name:<8} {summary['stage_totals_ms'][stage]:>12.1f} ms / "
+                     f"{summary['stage_means_ms'][stage]:>8.2f} ms")
+    if summary['multires'] is not None:
+        multires = summary['multires']
+        lines.append(f"Multi-resolution: {multires['escalations']}/{multires['analyses']} escalated to full resolution "
+                     f"({multires['escalation_rate']:.1%}), ~{multires['estimated_saved_ms'] / 1000:.2f}s analysis time saved")
+    if summary['peak_mem_mb'] is not None:
+        lines.append(f"Peak traced memory per image (numpy/OpenCV buffers): {summary['peak_mem_mb']:.1f} MB")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch ER analysis of LFA test strip images")
+    parser.add_argument('directory', nargs='?', help="Directory of images (searched recursively)")
+    parser.add_argument('--manifest', help="Text file with one image path per line")
+    parser.add_argument('--output', '-o', default='-',
+                        help="Output file (.csv, .ndjson, .db/.sqlite); '-' writes NDJSON to stdout")
+    parser.add_argument('--format', choices=['csv', 'ndjson', 'sqlite'],
+                        help="Output format (default: inferred from the output extension)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Worker processes (default: number of CPU cores)")
+    parser.add_argument('--calibration-ref', help="Color reference image, as in the app's calibration step")
+    parser.add_argument('--calibration-profile', help="Name of a saved color calibration profile to apply")
+    parser.add_argument('--profiles-file', help="Calibration profiles file (default: next to patients.db)")
+    parser.add_argument('--full-frame', action='store_true',
+                        help="Analyze the whole photo instead of the detected strip (the app's checkbox off)")
+    parser.add_argument('--mode', choices=ANALYSIS_MODES, default="exact",
+                        help="exact analyzes every pixel; multires starts at 1/4 scale and escalates near cut points; "
+                             "tiled analyzes a larger decode with bounded memory; profile scores the test/control line ratio")
+    parser.add_argument('--max-memory-mb', type=int, default=None,
+                        help="Working-memory ceiling per image for --mode tiled")
+    parser.add_argument('--working-pixels', type=int, default=None,
+                        help="Decode images down to about this many pixels before analysis "
+                             "(default: the app's working resolution, or ER_TILED_MAX_PIXELS for --mode tiled, "
+                             "which refuses non-JPEG images above it; 0 analyzes full resolution)")
+    parser.add_argument('--backend', choices=list(ANALYSIS_BACKENDS),
+                        help="Pin the analysis backend (default: ER_ANALYSIS_BACKEND, else auto-selected)")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="Record peak memory per image with tracemalloc (adds some overhead)")
+    args = parser.parse_args(argv)
+
+    if not args.directory and not args.manifest:
+        parser.error("provide an image directory and/or --manifest")
+
+    if args.calibration_profile:
+        store = CalibrationProfileStore(args.profiles_file) if args.profiles_file else CalibrationProfileStore()
+        if store.get(args.calibration_profile) is None:
+            parser.error(f"unknown calibration profile: {args.calibration_profile}")
+
+    paths = collect_image_paths(args.directory, args.manifest)
+    if not paths:
+        print("No images found.", file=sys.stderr)
+        return 1
+
+    writer = open_result_writer(args.output, args.format)
+    try:
+        summary = run_batch(paths, writer, workers=args.workers, calibration_path=args.calibration_ref,
+                            detect_roi=not args.full_frame, mode=args.mode,
+                            calibration_profile=args.calibration_profile, profiles_path=args.profiles_file,
+                            max_memory_mb=args.max_memory_mb, max_pixels=args.working_pixels,
+                            backend=args.backend,
+                            trace_memory=args.trace_memory)
+    finally:
+        writer.close()
+
+    print(format_summary(summary), file=sys.stderr)
+    return 0 if summary['failed'] == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
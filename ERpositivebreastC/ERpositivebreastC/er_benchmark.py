@@ -0,0 +1,190 @@
+"""Latency and memory benchmarks for the ER image analysis engine.
+
+Times analyze_er_image_with_confidence on synthetic strip photos at several
+resolutions and test-line intensities, once per analysis backend (by default
+OpenCV and the LUT fallback used without OpenCV). Records p50/p95 latency and
+peak traced memory per case, and compares them against a stored baseline,
+exiting non-zero when any case regresses past the threshold.
+
+Baselines are machine specific, so record one on the machine that runs the
+comparison:
+    python er_benchmark.py --save-baseline
+    python er_benchmark.py --threshold 0.25
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import er_image_analysis
+from er_image_analysis import (
+    ANALYSIS_BACKENDS,
+    analyze_er_image_with_confidence,
+    make_synthetic_strip,
+    use_backend,
+)
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "er_benchmark_baseline.json")
+
+DEFAULT_RESOLUTIONS = ((640, 480), (1600, 1200), (4000, 3000))
+
+# 0 is a blank test line, 1 a fully saturated one
+DEFAULT_INTENSITIES = (0.0, 0.3, 1.0)
+
+# Latency below this is timer noise, so it is never reported as a regression
+MIN_REGRESSION_MS = 1.0
+
+# The OpenCV path and the fallback used without OpenCV; the pure NumPy backend is opt-in (slow)
+DEFAULT_BACKENDS = ("opencv", "lut")
+
+
+def percentile(values, q):
+    return float(np.percentile(np.asarray(values, dtype=np.float64), q))
+
+
+def benchmark_case(image, repeats, detect_roi=True, mode="exact"):
+    """Time repeats analyses of image, then measure peak memory in one separate traced run"""
+    # Warm-up: builds the color LUT and any lazily imported OpenCV kernels
+    analyze_er_image_with_confidence(image, detect_roi=detect_roi, mode=mode)
+
+    # Keep collector pauses out of the latency percentiles
+    gc.collect()
+    gc.disable()
+    try:
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            analyze_er_image_with_confidence(image, detect_roi=detect_roi, mode=mode)
+            timings.append((time.perf_counter() - start) * 1000)
+    finally:
+        gc.enable()
+
+    # tracemalloc slows allocation down, so it stays out of the timed runs
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    analyze_er_image_with_confidence(image, detect_roi=detect_roi, mode=mode)
+    peak_mem_mb = (tracemalloc.get_traced_memory()[1] - baseline) / (1024 * 1024)
+    if not was_tracing:
+        tracemalloc.stop()
+
+    return {
+        'p50_ms': percentile(timings, 50),
+        'p95_ms': percentile(timings, 95),
+        'peak_mem_mb': peak_mem_mb
+    }
+
+
+def run_benchmarks(backends=DEFAULT_BACKENDS, resolutions=DEFAULT_RESOLUTIONS,
+                   intensities=DEFAULT_INTENSITIES, repeats=20, detect_roi=True, mode="exact", progress=None):
+    """Benchmark every backend x resolution x intensity case.
+
+    Returns {case_name: {'p50_ms', 'p95_ms', 'peak_mem_mb'}}, with case names
+    like "opencv/1600x1200/i0.3".
+    """
+    results = {}
+    for width, height in resolutions:
+        for intensity in intensities:
+            image = make_synthetic_strip(width, height, intensity)
+            for backend in backends:
+                name = f"{backend}/{width}x{height}/i{intensity:g}"
+                with use_backend(backend):
+                    results[name] = benchmark_case(image, repeats, detect_roi, mode)
+                if progress is not None:
+                    progress(name, results[name])
+    return results
+
+
+def compare_to_baseline(results, baseline, threshold):
+    """Return regression messages for cases that got slower or bigger than baseline * (1 + threshold)"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'peak_mem_mb'):
+            limit = previous[metric] * (1 + threshold)
+            if metric.endswith('_ms'):
+                limit = max(limit, previous[metric] + MIN_REGRESSION_MS)
+            if current[metric] > limit:
+                regressions.append(f"{name} {metric}: {current[metric]:.2f} vs baseline "
+                                   f"{previous[metric]:.2f} (+{current[metric] / max(previous[metric], 1e-9) - 1:.0%})")
+    return regressions
+
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['cases']
+
+
+def save_baseline(path, results, repeats, mode):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'engine_version': er_image_analysis.ANALYSIS_ENGINE_VERSION,
+            'mode': mode,
+            'repeats': repeats,
+            'cases': results
+        }, f, indent=2)
+
+
+def _parse_resolution(text):
+    width, _, height = text.lower().partition('x')
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ER image analysis engine")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH, help="Baseline JSON file")
+    parser.add_argument('--save-baseline', action='store_true', help="Write the results as the new baseline")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Allowed relative regression per metric before failing (default: 0.2 = 20%%)")
+    parser.add_argument('--repeats', type=int, default=20, help="Timed runs per case")
+    parser.add_argument('--resolution', action='append', type=_parse_resolution,
+                        help="WIDTHxHEIGHT to benchmark (repeatable)")
+    parser.add_argument('--intensity', action='append', type=float, help="Test-line intensity 0-1 (repeatable)")
+    parser.add_argument('--backend', action='append', choices=list(ANALYSIS_BACKENDS),
+                        help="Analysis backend to benchmark (repeatable; default: opencv and lut, where available)")
+    parser.add_argument('--mode', choices=er_image_analysis.ANALYSIS_MODES, default="exact")
+    parser.add_argument('--full-frame', action='store_true', help="Skip strip detection")
+    args = parser.parse_args(argv)
+
+    backends = args.backend
+    if not backends:
+        backends = [name for name in DEFAULT_BACKENDS if ANALYSIS_BACKENDS[name].is_available()]
+
+    def progress(name, result):
+        print(f"{name:<28} p50 {result['p50_ms']:8.2f} ms   p95 {result['p95_ms']:8.2f} ms   "
+              f"peak {result['peak_mem_mb']:7.1f} MB", file=sys.stderr)
+
+    results = run_benchmarks(backends, args.resolution or DEFAULT_RESOLUTIONS,
+                             args.intensity or DEFAULT_INTENSITIES, args.repeats,
+                             detect_roi=not args.full_frame, mode=args.mode, progress=progress)
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results, args.repeats, args.mode)
+        print(f"Baseline saved to {args.baseline}", file=sys.stderr)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline first.", file=sys.stderr)
+        return 0
+
+    regressions = compare_to_baseline(results, load_baseline(args.baseline), args.threshold)
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}:", file=sys.stderr)
+        for message in regressions:
+            print(f"  {message}", file=sys.stderr)
+        return 1
+    print(f"No regressions beyond {args.threshold:.0%}.", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""Burst and video capture mode: analyze sampled frames until the estimate settles.
+
+A single photo of a strip is noisy (glare, focus, hand shake). Here a short
+clip or burst of shots of the same strip is read as a stream of frames,
+each sampled frame goes through analyze_er_image_with_confidence, and
+reading stops as soon as the running means of risk_score and confidence are
+known to within a tolerance (standard error of the mean, in percentage
+points). The final result is scored from the mean color statistics of the
+frames used.
+"""
+import math
+
+import numpy as np
+
+from er_image_analysis import CV2_AVAILABLE, analyze_er_image_with_confidence, build_er_results, cv2
+from er_image_ingest import WORKING_MAX_PIXELS, load_analysis_image, working_size
+
+# Stop once both running means are known to within this many percentage points
+BURST_TOLERANCE = 1.0
+
+# Never stop on fewer frames than this; two agreeing frames prove little
+BURST_MIN_FRAMES = 3
+
+# Frames analyzed at most; a clip is sampled evenly so these span all of it
+BURST_MAX_FRAMES = 30
+
+# Sampling stride for videos that don't report their length (about 1/3 s at 30 fps): neighbouring frames
+# are near-duplicates, and their agreement would pass for convergence
+UNKNOWN_LENGTH_STRIDE = 10
+
+
+def sample_indices(available, max_frames=BURST_MAX_FRAMES):
+    """Indices of at most max_frames frames spread evenly from the first to the last of available"""
+    if available <= 0:
+        return np.empty(0, dtype=np.intp)
+    count = min(available, max_frames)
+    return np.unique(np.linspace(0, available - 1, count).round().astype(np.intp))
+
+
+class VideoFrameSource:
+    """Evenly sampled RGB frames of a video file, streamed through cv2.VideoCapture.
+
+    Skipped frames are only grabbed, not decoded, and sampled frames are
+    scaled to the analysis working resolution. When the container doesn't
+    report a frame count, frames_available is None and every
+    UNKNOWN_LENGTH_STRIDE-th frame is sampled instead.
+    """
+
+    def __init__(self, path, max_frames=BURST_MAX_FRAMES, max_pixels=None):
+        if not (CV2_AVAILABLE and cv2 is not None):
+            raise RuntimeError("Video analysis requires OpenCV")
+        self.path = path
+        self.max_pixels = WORKING_MAX_PIXELS if max_pixels is None else max_pixels
+
+        capture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            raise ValueError(f"Could not open video: {path}")
+        # Some containers don't report a frame count (0 or negative)
+        frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        capture.release()
+        self.frames_available = frame_count if frame_count > 0 else None
+        # None (unknown length): every UNKNOWN_LENGTH_STRIDE-th frame until analyze_burst stops
+        indices = sample_indices(self.frames_available or 0, max_frames)
+        self.sampled = set(indices.tolist()) if self.frames_available else None
+        self.last_sampled = int(indices[-1]) if len(indices) else None
+
+    def is_sampled(self, index):
+        if self.sampled is None:
+            return index % UNKNOWN_LENGTH_STRIDE == 0
+        return index in self.sampled
+
+    def __iter__(self):
+        capture = cv2.VideoCapture(self.path)
+        try:
+            index = 0
+            while True:
+                if not self.is_sampled(index):
+                    if (self.sampled is not None and index > self.last_sampled) or not capture.grab():
+                        break
+                    index += 1
+                    continue
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                index += 1
+
+                height, width = frame.shape[:2]
+                target = working_size((width, height), self.max_pixels)
+                if target != (width, height):
+                    frame = cv2.resize(frame, target, interpolation=cv2.INTER_AREA)
+                yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        finally:
+            capture.release()
+
+
+class BurstFrameSource:
+    """Frames of a burst of still photos (encoded bytes or paths), decoded lazily.
+
+    Bursts longer than max_frames are sampled evenly, like videos.
+    """
+
+    def __init__(self, images, max_frames=BURST_MAX_FRAMES, max_pixels=None):
+        self.images = list(images)
+        self.max_pixels = max_pixels
+        self.frames_available = len(self.images)
+        self.sampled = sample_indices(self.frames_available, max_frames)
+
+    def __iter__(self):
+        for index in self.sampled:
+            yield load_analysis_image(self.images[index], self.max_pixels)
+
+
+class RunningMean:
+    """Welford running mean and variance"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    @property
+    def std_error(self):
+        if self.count < 2:
+            return math.inf
+        return math.sqrt(self.m2 / (self.count - 1) / self.count)
+
+
+def analyze_burst(frames, calibration_ref=None, tolerance=BURST_TOLERANCE, min_frames=BURST_MIN_FRAMES,
+                  max_frames=BURST_MAX_FRAMES, **options):
+    """Analyze frames one at a time and stop once risk_score and confidence converge.
+
+    frames is a VideoFrameSource, a BurstFrameSource or any iterable of RGB
+    arrays; options are passed to analyze_er_image_with_confidence. Returns
+    the usual ERResult scored from the mean red coverage and color of
+    the frames used, plus frames_used, frames_available, converged, the
+    standard errors reached and the per-frame scores.
+    """
+    risk = RunningMean()
+    confidence = RunningMean()
+    coverage = []
+    frame_scores = []
+    converged = False
+
+    for frame in frames:
+        result = analyze_er_image_with_confidence(frame, calibration_ref, **options)
+        risk.add(result['risk_score'])
+        confidence.add(result['confidence'])
+        coverage.append((result['er_intensity'] / 100, result['avg_red_value'], result['color_saturation']))
+        frame_scores.append({'risk_score': float(result['risk_score']), 'confidence': float(result['confidence'])})
+
+        if risk.count >= min_frames and risk.std_error <= tolerance and confidence.std_error <= tolerance:
+            converged = True
+            break
+        if risk.count >= max_frames:
+            break
+
+    if not coverage:
+        raise ValueError("No frames could be read")
+
+    red_intensity, avg_red_value, color_saturation = np.mean(np.asarray(coverage, dtype=np.float64), axis=0)
+    results = build_er_results(red_intensity, avg_red_value, color_saturation)
+    results.update({
+        'frames_used': len(coverage),
+        'frames_available': getattr(frames, 'frames_available', None),
+        'converged': converged,
+        'risk_score_std_error': risk.std_error if risk.count > 1 else None,
+        'confidence_std_error': confidence.std_error if confidence.count > 1 else None,
+        'frame_scores': frame_scores
+    })
+    return results
@@ -0,0 +1,149 @@
+"""Persistent color-calibration profiles applied as per-channel lookup tables.
+
+A profile is fitted once from a photo of a reference patch with a known color
+(red by default, like the app's calibration step). It stores a per-channel
+correction curve, out = clip((in - offset) * gain), and is saved by name per
+device or lighting setup. Applying it is one 256-entry LUT lookup per channel,
+so repeat analyses don't redo calibration math or keep the reference image.
+
+Every session of a server shares the profiles file, and other users'
+analyses may be using a profile, so saving under an existing name is
+refused unless the caller explicitly asks to replace it.
+"""
+import datetime
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from er_image_analysis import CV2_AVAILABLE, cv2
+
+# The app's calibration patches are pure red
+DEFAULT_REFERENCE_RGB = (255, 0, 0)
+
+# Profiles live next to patients.db
+DEFAULT_PROFILES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "calibration_profiles.json")
+
+
+class CalibrationProfile:
+    """Named per-channel color correction with a precomputed LUT"""
+
+    def __init__(self, name, gains, offsets, reference_rgb=DEFAULT_REFERENCE_RGB,
+                 measured_rgb=None, created=None):
+        self.name = name
+        self.gains = [float(g) for g in gains]
+        self.offsets = [float(o) for o in offsets]
+        self.reference_rgb = [int(c) for c in reference_rgb]
+        self.measured_rgb = [float(c) for c in measured_rgb] if measured_rgb is not None else None
+        self.created = created or datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+        self._lut = None
+
+    @property
+    def lut(self):
+        """(256, 1, 3) uint8 table: lut[v, 0, c] is the corrected value of v in channel c"""
+        if self._lut is None:
+            levels = np.arange(256, dtype=np.float64)
+            curves = [np.clip((levels - offset) * gain, 0, 255)
+                      for gain, offset in zip(self.gains, self.offsets)]
+            self._lut = np.round(np.stack(curves, axis=-1)).astype(np.uint8).reshape(256, 1, 3)
+        return self._lut
+
+    def apply(self, img_array):
+        """Return a color-corrected copy of an RGB(A) uint8 array"""
+        rgb = img_array[..., :3]
+        if CV2_AVAILABLE and cv2 is not None:
+            return cv2.LUT(np.ascontiguousarray(rgb), self.lut)
+
+        corrected = np.empty(rgb.shape, dtype=np.uint8)
+        for channel in range(3):
+            np.take(self.lut[:, 0, channel], rgb[..., channel], out=corrected[..., channel])
+        return corrected
+
+    def fingerprint(self):
+        """Stable hash of the correction, used in analysis cache keys"""
+        return hashlib.sha256(self.lut.tobytes()).hexdigest()[:16]
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'gains': self.gains,
+            'offsets': self.offsets,
+            'reference_rgb': self.reference_rgb,
+            'measured_rgb': self.measured_rgb,
+            'created': self.created
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['name'], data['gains'], data['offsets'],
+                   reference_rgb=data.get('reference_rgb', DEFAULT_REFERENCE_RGB),
+                   measured_rgb=data.get('measured_rgb'),
+                   created=data.get('created'))
+
+
+def fit_calibration_profile(name, reference_image, reference_rgb=DEFAULT_REFERENCE_RGB):
+    """Fit per-channel curves that map the photographed patch onto reference_rgb.
+
+    Channels the reference lights up get a gain that scales the measured mean
+    to the expected value. Channels expected to be 0 get an offset that
+    removes the measured cast, with the remaining range stretched back to
+    0-255.
+    """
+    patch = np.asarray(reference_image)
+    if patch.ndim != 3:
+        raise ValueError("Calibration reference must be a color image")
+    measured = patch[..., :3].reshape(-1, 3).mean(axis=0)
+
+    gains = []
+    offsets = []
+    for expected, actual in zip(reference_rgb, measured):
+        if expected > 0:
+            gains.append(np.clip(expected / actual, 0.5, 2.0) if actual > 0 else 1.0)
+            offsets.append(0.0)
+        else:
+            offset = min(actual, 254.0)
+            gains.append(255.0 / (255.0 - offset))
+            offsets.append(offset)
+
+    return CalibrationProfile(name, gains, offsets, reference_rgb=reference_rgb, measured_rgb=measured)
+
+
+class CalibrationProfileStore:
+    """Named calibration profiles persisted in a JSON file"""
+
+    def __init__(self, path=DEFAULT_PROFILES_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.profiles = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for data in json.load(f):
+                    profile = CalibrationProfile.from_dict(data)
+                    self.profiles[profile.name] = profile
+
+    def names(self):
+        return sorted(self.profiles)
+
+    def get(self, name):
+        return self.profiles.get(name)
+
+    def save(self, profile, replace=False):
+        """Store profile under its name; a profile of that name is only replaced when replace is set"""
+        with self.lock:
+            if profile.name in self.profiles and not replace:
+                raise ValueError(f"A calibration profile named {profile.name!r} already exists")
+            self.profiles[profile.name] = profile
+            self._write()
+
+    def delete(self, name):
+        with self.lock:
+            if self.profiles.pop(name, None) is not None:
+                self._write()
+
+    def _write(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump([p.to_dict() for p in self.profiles.values()], f, indent=2)
+        os.replace(tmp_path, self.path)
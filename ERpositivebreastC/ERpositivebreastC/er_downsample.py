@@ -0,0 +1,78 @@
+"""Server-side downsampling of long trend series before they are charted.
+
+Plotly sends every point of a trace to the browser, and a multi-year
+history drawn with lines+markers makes figure payloads of several
+megabytes and slow pans. trend_trace() passes series longer than
+PLOT_MAX_POINTS through Largest-Triangle-Three-Buckets (LTTB) first. LTTB
+keeps the first and last points and, from each bucket in between, the
+point that spans the largest triangle with its neighbours, so peaks,
+dips and level changes survive. Traces that still have more than
+WEBGL_MIN_POINTS points are drawn with WebGL (go.Scattergl).
+
+Only the drawing is downsampled. Threshold lines and alerts are still
+worked out from the full history by the callers.
+"""
+import os
+
+import numpy as np
+import plotly.graph_objects as go
+
+# Points per trace sent to the browser; longer series are downsampled with LTTB
+PLOT_MAX_POINTS = int(os.environ.get("ER_PLOT_MAX_POINTS", "1500"))
+
+# Traces with more points than this are drawn with WebGL
+WEBGL_MIN_POINTS = int(os.environ.get("ER_WEBGL_MIN_POINTS", "1000"))
+
+
+def lttb(x, y, n_out):
+    """Indices of the n_out points LTTB keeps from the series (x, y), in order.
+
+    x must be ascending; datetime64 x values are compared as integers. All
+    indices are returned when the series has n_out points or fewer.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x)
+    x = (x.astype('datetime64[s]').astype(np.int64) if np.issubdtype(x.dtype, np.datetime64) else x).astype(np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # First and last points are kept; the rest are split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.intp)
+    selected = np.empty(n_out, dtype=np.intp)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for bucket in range(n_out - 2):
+        lo, hi = edges[bucket], edges[bucket + 1]
+        # The next bucket's average point is the third corner (the last point for the last bucket)
+        next_hi = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        avg_x = x[hi:next_hi].mean()
+        avg_y = y[hi:next_hi].mean()
+        areas = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(areas))
+        selected[bucket + 1] = a
+    return selected
+
+
+def downsample(x, y, max_points=PLOT_MAX_POINTS):
+    """(x, y) with NaN values dropped and at most max_points points kept by LTTB"""
+    y = np.asarray(y, dtype=np.float64)
+    present = ~np.isnan(y)
+    if not present.all():
+        x, y = np.asarray(x)[present], y[present]
+    keep = lttb(x, y, max_points)
+    if len(keep) == len(y):
+        return x, y
+    return np.asarray(x)[keep], y[keep]
+
+
+def trace_class(point_count):
+    """go.Scattergl for traces with more than WEBGL_MIN_POINTS points, go.Scatter otherwise"""
+    return go.Scattergl if point_count > WEBGL_MIN_POINTS else go.Scatter
+
+
+def trend_trace(x, y, max_points=PLOT_MAX_POINTS, **trace_args):
+    """Scatter trace of (x, y), downsampled with LTTB and switched to WebGL when long"""
+    x, y = downsample(x, y, max_points)
+    return trace_class(len(y))(x=x, y=y, **trace_args)
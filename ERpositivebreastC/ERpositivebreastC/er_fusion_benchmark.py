@@ -0,0 +1,100 @@
+"""Throughput benchmark for batch multi-factor risk fusion.
+
+Builds a synthetic registry (ER risk scores, symptom severities with
+unreported symptoms, family flags and test frequencies) and times
+multi_factor_risk_fusion_batch on all of it. A sample of rows is then scored
+again with the scalar multi_factor_risk_fusion to time it and to check that
+levels, scores and colors match exactly; any mismatch exits non-zero.
+
+    python er_fusion_benchmark.py --rows 1000000
+"""
+import argparse
+import math
+import sys
+import time
+
+import numpy as np
+
+from er_risk_fusion import FAMILY_FACTORS, multi_factor_risk_fusion, multi_factor_risk_fusion_batch
+
+# The symptom questions the app asks, in the order it records them
+SYMPTOMS = ('lumps', 'skin_changes', 'nipple_discharge', 'breast_pain', 'size_changes', 'nipple_inversion',
+            'skin_redness', 'lymph_nodes', 'breast_heaviness', 'menstrual_changes')
+
+
+def make_registry(rows, seed=0, unreported=0.3):
+    """Columnar inputs for rows patients; a fraction unreported of symptom answers is NaN"""
+    rng = np.random.default_rng(seed)
+    symptoms = {}
+    for name in SYMPTOMS:
+        severities = rng.integers(0, 6, rows).astype(np.float64)
+        severities[rng.random(rows) < unreported] = np.nan
+        symptoms[name] = severities
+    return {
+        'er_risk_score': rng.random(rows) * 100,
+        'symptoms': symptoms,
+        'family': {factor: rng.random(rows) < 0.2 for factor, _ in FAMILY_FACTORS},
+        'test_frequency': rng.integers(0, 7, rows)
+    }
+
+
+def score_scalar(registry, index):
+    symptoms = {name: severities[index] for name, severities in registry['symptoms'].items()
+                if not math.isnan(severities[index])}
+    family = {factor: bool(flags[index]) for factor, flags in registry['family'].items()}
+    return multi_factor_risk_fusion({'risk_score': registry['er_risk_score'][index]}, symptoms, family,
+                                    registry['test_frequency'][index])
+
+
+def run_benchmark(rows, repeats=3, verify_rows=20000, seed=0):
+    registry = make_registry(rows, seed)
+
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        scores = multi_factor_risk_fusion_batch(registry['er_risk_score'], registry['symptoms'],
+                                                registry['family'], registry['test_frequency'])
+        timings.append(time.perf_counter() - start)
+
+    sample = np.linspace(0, rows - 1, min(verify_rows, rows)).astype(np.intp)
+    start = time.perf_counter()
+    expected = [score_scalar(registry, index) for index in sample]
+    scalar_time = time.perf_counter() - start
+
+    mismatches = sum(1 for index, (level, score, color) in zip(sample, expected)
+                     if (level, score, color) != (scores['risk_level'][index], scores['risk_score'][index],
+                                                  scores['color'][index]))
+    batch_time = min(timings)
+    return {
+        'rows': rows,
+        'batch_s': batch_time,
+        'batch_rows_per_s': rows / batch_time,
+        'scalar_rows': len(sample),
+        'scalar_rows_per_s': len(sample) / scalar_time,
+        'mismatches': mismatches
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000, help="Registry size (default: 1,000,000)")
+    parser.add_argument('--repeats', type=int, default=3, help="Batch runs; the fastest is reported")
+    parser.add_argument('--verify', type=int, default=20000, help="Rows re-scored with the scalar function")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    result = run_benchmark(args.rows, args.repeats, args.verify, args.seed)
+    print(f"batch   {result['rows']:>9} rows  {result['batch_s'] * 1000:8.1f} ms  "
+          f"{result['batch_rows_per_s']:12,.0f} rows/s", file=sys.stderr)
+    print(f"scalar  {result['scalar_rows']:>9} rows  {'':11}  {result['scalar_rows_per_s']:12,.0f} rows/s",
+          file=sys.stderr)
+    if result['mismatches']:
+        print(f"{result['mismatches']} of {result['scalar_rows']} rows differ from the scalar scores",
+              file=sys.stderr)
+        return 1
+    print(f"All {result['scalar_rows']} checked rows match the scalar scores exactly.", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
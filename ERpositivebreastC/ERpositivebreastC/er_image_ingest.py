@@ -0,0 +1,155 @@
+"""Image ingest for the analyzers: decode straight to the working resolution.
+
+JPEGs are decoded with PIL's draft mode, which lets libjpeg scale the DCT by
+1/2, 1/4 or 1/8 while decoding, so a 48 MP phone photo never exists at full
+size in memory. Other formats are decoded and then box-reduced. Modes are
+normalized to RGB in one conversion, and the analyzer gets a contiguous uint8
+array.
+
+Run this module directly to print decode time and memory for common phone
+photo sizes.
+"""
+import os
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+# Largest image (in pixels) handed to the analyzer; 0 keeps full resolution.
+# Red coverage is a fraction of the frame, so ~3 MP keeps results stable.
+WORKING_MAX_PIXELS = int(os.environ.get("ER_WORKING_MAX_PIXELS", "3000000"))
+
+
+# Largest image tiled analysis decodes; JPEGs above it are scaled by the decoder, other formats refused
+TILED_MAX_PIXELS = int(os.environ.get("ER_TILED_MAX_PIXELS", "12000000"))
+
+
+def analysis_max_pixels(mode, max_pixels=None):
+    """Pixel limit to decode at for an analysis mode; an explicit max_pixels wins.
+
+    Tiled analysis decodes at up to TILED_MAX_PIXELS (see
+    decode_bounded_image); the other modes use WORKING_MAX_PIXELS.
+    """
+    if max_pixels is not None:
+        return max_pixels
+    return TILED_MAX_PIXELS if mode == "tiled" else WORKING_MAX_PIXELS
+
+
+def open_image(source):
+    """Open bytes, a path, an uploaded file or a PIL image without decoding it"""
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return Image.open(BytesIO(source))
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    return Image.open(source)
+
+
+def working_size(size, max_pixels):
+    """Target (width, height) that fits max_pixels, keeping the aspect ratio"""
+    width, height = size
+    if not max_pixels or width * height <= max_pixels:
+        return width, height
+    scale = (max_pixels / (width * height)) ** 0.5
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def decode_analysis_image(source, max_pixels=None):
+    """Decode source at (about) the working resolution as an RGB PIL image.
+
+    The result is never smaller than the working size: draft decoding only
+    picks a DCT scale that still covers it, and the box reduce uses the
+    largest integer factor that does.
+    """
+    max_pixels = WORKING_MAX_PIXELS if max_pixels is None else max_pixels
+    image = open_image(source)
+    target = working_size(image.size, max_pixels)
+
+    if target != image.size and image.format == 'JPEG':
+        # Let libjpeg scale while decoding; it also decodes YCbCr straight to RGB
+        image.draft('RGB', target)
+
+    # Box-reduce whatever the decoder couldn't, by the largest factor that still covers the target
+    factor = min(image.size[0] // target[0], image.size[1] // target[1])
+    if factor > 1:
+        image = image.reduce(factor)
+
+    if image.mode != 'RGB':
+        # RGBA, LA, P, L, CMYK, I;16 ... all become RGB in a single conversion
+        image = image.convert('RGB')
+    image.load()
+    return image
+
+
+def decode_bounded_image(source, max_pixels=TILED_MAX_PIXELS):
+    """Decode source as an RGB PIL image of at most max_pixels (0: no limit).
+
+    Unlike decode_analysis_image, the limit also holds while decoding: JPEGs
+    are decoded at the smallest DCT scale (1, 1/2, 1/4 or 1/8) that fits,
+    and other formats, which PIL can only decode whole, are refused with a
+    ValueError before decoding when they are larger.
+    """
+    image = open_image(source)
+    width, height = image.size
+    if max_pixels and image.format == 'JPEG':
+        for scale in (1, 2, 4, 8):
+            if -(-width // scale) * -(-height // scale) <= max_pixels:
+                break
+        image.draft('RGB', (width // scale, height // scale))
+
+    if max_pixels and image.size[0] * image.size[1] > max_pixels:
+        raise ValueError(f"{width}x{height} image is larger than the {max_pixels:,} pixels "
+                         f"that can be decoded for this analysis")
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    image.load()
+    return image
+
+
+def load_analysis_image(source, max_pixels=None):
+    """Decode source at the working resolution into a contiguous RGB uint8 array"""
+    return np.ascontiguousarray(np.asarray(decode_analysis_image(source, max_pixels)))
+
+
+def benchmark_ingest(sizes=((4000, 3000), (8000, 6000), (12000, 9000)), max_pixels=None, repeats=3):
+    """Time full decodes against working-resolution decodes of synthetic phone JPEGs.
+
+    Returns one dict per size with decode times (ms) and the resulting array size (MB).
+    """
+    rng = np.random.default_rng(0)
+    results = []
+    for width, height in sizes:
+        # Smooth gradients plus noise compress like a photo, unlike pure noise
+        base = np.linspace(60, 220, width, dtype=np.float32)[None, :, None]
+        tile = (base + rng.normal(0, 8, (256, width, 3))).clip(0, 255).astype(np.uint8)
+        pixels = np.resize(tile, (height, width, 3))
+        buffer = BytesIO()
+        Image.fromarray(pixels).save(buffer, format='JPEG', quality=90)
+        data = buffer.getvalue()
+        del pixels, tile
+
+        row = {'size': f"{width}x{height}", 'megapixels': width * height / 1e6, 'jpeg_mb': len(data) / 2**20}
+        for label, limit in (('full', 0), ('working', max_pixels)):
+            best = None
+            for _ in range(repeats):
+                start = time.perf_counter()
+                array = load_analysis_image(data, limit)
+                elapsed = (time.perf_counter() - start) * 1000
+                best = elapsed if best is None else min(best, elapsed)
+            row[f'{label}_ms'] = best
+            row[f'{label}_shape'] = array.shape
+            row[f'{label}_mb'] = array.nbytes / 2**20
+            del array
+        results.append(row)
+    return results
+
+
+if __name__ == "__main__":
+    print(f"Working resolution: {WORKING_MAX_PIXELS / 1e6:.1f} MP")
+    for row in benchmark_ingest():
+        print(f"{row['size']:>12} ({row['megapixels']:.0f} MP, {row['jpeg_mb']:.1f} MB JPEG): "
+              f"full {row['full_ms']:7.1f} ms / {row['full_mb']:6.1f} MB -> "
+              f"working {row['working_ms']:6.1f} ms / {row['working_mb']:5.1f} MB {row['working_shape']}")
@@ -0,0 +1,168 @@
+"""Bounded background queue for analyses, so page scripts never block on them.
+
+A page submits an analysis and gets a job id back immediately, keeps the id
+in st.session_state and polls the job on later reruns (the app uses a
+fragment that reruns every half second) until the result is ready. All
+sessions share one queue per server process. It runs jobs on a fixed
+thread pool and refuses new ones with QueueFullError once capacity jobs
+are queued or running, so a busy server tells users to retry instead of
+piling up script threads.
+
+Jobs report progress through report_progress(done, total), which finds the
+job from the worker thread it is called on; analyze_many's progress
+callback can be passed straight through.
+"""
+import collections
+import concurrent.futures
+import itertools
+import os
+import threading
+import time
+import uuid
+
+# Analyses running at once; each one may still fan out (analyze_many has its own pool)
+JOB_WORKERS = int(os.environ.get("ER_JOB_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Jobs queued or running before submit() refuses new ones
+JOB_QUEUE_CAPACITY = int(os.environ.get("ER_JOB_QUEUE_CAPACITY", "32"))
+
+# Finished jobs are kept this long for their page to pick them up
+JOB_RESULT_TTL_S = 600
+
+
+class QueueFullError(RuntimeError):
+    """Raised by AnalysisJobQueue.submit when capacity jobs are already pending"""
+
+    def __init__(self, pending, capacity):
+        super().__init__(f"Analysis queue is full ({pending}/{capacity} jobs pending)")
+        self.pending = pending
+        self.capacity = capacity
+
+
+class AnalysisJob:
+    """State of one submitted analysis, updated by the worker thread running it"""
+
+    def __init__(self, job_id, sequence, label=""):
+        self.id = job_id
+        self.sequence = sequence
+        self.label = label
+        self.status = "queued"
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+
+    @property
+    def done(self):
+        return self.status in ("done", "failed")
+
+    @property
+    def elapsed(self):
+        """Seconds spent running (so far), excluding time in the queue"""
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+
+_current_job = threading.local()
+
+
+def report_progress(done, total):
+    """Record progress of the job running on this thread; a no-op outside a job"""
+    job = getattr(_current_job, 'job', None)
+    if job is not None and total:
+        job.progress = min(1.0, done / total)
+
+
+class AnalysisJobQueue:
+    """Fixed pool of worker threads with a bounded number of pending jobs"""
+
+    def __init__(self, max_workers=JOB_WORKERS, capacity=JOB_QUEUE_CAPACITY, result_ttl=JOB_RESULT_TTL_S):
+        self.max_workers = max_workers
+        self.capacity = capacity
+        self.result_ttl = result_ttl
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                              thread_name_prefix="er-analysis")
+        self.jobs = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.sequence = itertools.count()
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def _pending(self):
+        return sum(1 for job in self.jobs.values() if not job.done)
+
+    def submit(self, fn, *args, label="", **kwargs):
+        """Queue fn(*args, **kwargs) and return its job id, or raise QueueFullError"""
+        with self.lock:
+            self._purge()
+            pending = self._pending()
+            if pending >= self.capacity:
+                self.rejected += 1
+                raise QueueFullError(pending, self.capacity)
+            job = AnalysisJob(uuid.uuid4().hex, next(self.sequence), label)
+            self.jobs[job.id] = job
+        self.executor.submit(self._run, job, fn, args, kwargs)
+        return job.id
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = "running"
+        job.started = time.time()
+        _current_job.job = job
+        try:
+            job.result = fn(*args, **kwargs)
+            job.progress = 1.0
+            job.status = "done"
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            job.status = "failed"
+        finally:
+            _current_job.job = None
+            job.finished = time.time()
+            with self.lock:
+                if job.status == "done":
+                    self.completed += 1
+                else:
+                    self.failed += 1
+
+    def get(self, job_id):
+        """The AnalysisJob for job_id, or None if it is unknown or expired"""
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def discard(self, job_id):
+        """Forget a finished job once its result has been picked up"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None and job.done:
+                del self.jobs[job_id]
+
+    def position(self, job_id):
+        """Number of queued jobs ahead of job_id (0 once it is running)"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status != "queued":
+                return 0
+            return sum(1 for other in self.jobs.values()
+                       if other.status == "queued" and other.sequence < job.sequence)
+
+    def _purge(self):
+        cutoff = time.time() - self.result_ttl
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.done and job.finished < cutoff]:
+            del self.jobs[job_id]
+
+    def stats(self):
+        with self.lock:
+            statuses = collections.Counter(job.status for job in self.jobs.values())
+            return {
+                'queued': statuses['queued'],
+                'running': statuses['running'],
+                'capacity': self.capacity,
+                'workers': self.max_workers,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected
+            }
@@ -0,0 +1,584 @@
+"""Persistent patient records in patients.db.
+
+Risk assessments, biomarker results, family history, symptom checks and
+chat messages used to live only in st.session_state and were lost on
+refresh. Each kind now has its own typed table keyed by patient, with an
+index on (patient_id, date).
+
+The database runs in WAL mode, so readers don't block the writer. Each
+process shares one connection, guarded by a lock. Writes take lists of
+entries and go through executemany in a single transaction.
+
+Sessions load compact RiskHistory / BiomarkerHistory columns from here.
+Bulky per-assessment details (the full analysis result) stay in the
+database and are only read back for exports and backups.
+
+The schema is versioned with PRAGMA user_version. On open, every
+migration newer than the file's version is applied in order, each in its
+own transaction. PatientStore.predictions is the repository of individual image
+analysis outcomes.
+
+PatientStore.cohort is the clinic's view of all patients. It reads
+patient_summaries, which holds one pre-aggregated row per patient: latest
+risk, adherence, next due date, ER trend and so on. Every write of a
+patient's risk assessments or biomarker results recomputes that patient's
+row in the same transaction, so listing thousands of patients is an
+indexed query over one table. Patients are listed by id: their names are
+the keys of their records' page links, so the cohort never returns them.
+"""
+import contextlib
+import datetime
+import json
+import os
+import re
+import secrets
+import sqlite3
+import threading
+
+import numpy as np
+
+from er_adherence import AdherenceTracker
+from er_records import BiomarkerHistory, ERResult, RiskHistory
+
+PATIENT_DB_PATH = os.environ.get(
+    "ER_PATIENT_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "patients.db"))
+
+# Each browser session's records are filed under a random patient key, so sessions never share records
+PATIENT_KEY_BYTES = 16
+_PATIENT_KEY_PATTERN = re.compile(r"[A-Za-z0-9_-]{22,}")
+
+INITIAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS risk_assessments (
+    id INTEGER PRIMARY KEY,
+    patient_id INTEGER NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+    date TEXT NOT NULL,
+    risk TEXT,
+    risk_score REAL,
+    confidence REAL,
+    type TEXT,
+    details TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_risk_assessments_patient_date ON risk_assessments (patient_id, date);
+CREATE TABLE IF NOT EXISTS biomarker_results (
+    id INTEGER PRIMARY KEY,
+    patient_id INTEGER NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+    date TEXT NOT NULL,
+    er REAL,
+    pr REAL,
+    her2 REAL,
+    confidence REAL,
+    risk_level TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_biomarker_results_patient_date ON biomarker_results (patient_id, date);
+CREATE TABLE IF NOT EXISTS family_history (
+    patient_id INTEGER NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+    factor TEXT NOT NULL,
+    present INTEGER NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (patient_id, factor)
+);
+CREATE TABLE IF NOT EXISTS symptom_checks (
+    id INTEGER PRIMARY KEY,
+    patient_id INTEGER NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+    date TEXT NOT NULL,
+    symptom TEXT NOT NULL,
+    present INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_symptom_checks_patient_date ON symptom_checks (patient_id, date);
+CREATE TABLE IF NOT EXISTS chat_messages (
+    id INTEGER PRIMARY KEY,
+    patient_id INTEGER NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+    date TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chat_messages_patient_date ON chat_messages (patient_id, date);
+"""
+
+PREDICTIONS_SCHEMA = """
+CREATE TABLE predictions (
+    id INTEGER PRIMARY KEY,
+    patient_id INTEGER NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+    date TEXT NOT NULL,
+    source TEXT,
+    er_status TEXT,
+    risk_level TEXT,
+    risk_score REAL,
+    confidence REAL,
+    er_intensity REAL,
+    engine_version TEXT
+);
+CREATE INDEX idx_predictions_patient_date ON predictions (patient_id, date);
+CREATE INDEX idx_predictions_date ON predictions (date);
+"""
+
+PATIENT_SUMMARIES_SCHEMA = """
+CREATE TABLE patient_summaries (
+    patient_id INTEGER PRIMARY KEY REFERENCES patients(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    tests INTEGER NOT NULL,
+    last_test TEXT,
+    next_due TEXT,
+    latest_risk TEXT,
+    latest_risk_score REAL,
+    adherence_score INTEGER NOT NULL,
+    mean_interval REAL,
+    er_readings INTEGER NOT NULL,
+    er_latest REAL,
+    er_slope REAL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX idx_patient_summaries_name ON patient_summaries (name);
+CREATE INDEX idx_patient_summaries_last_test ON patient_summaries (last_test);
+CREATE INDEX idx_patient_summaries_next_due ON patient_summaries (next_due);
+CREATE INDEX idx_patient_summaries_risk ON patient_summaries (latest_risk, latest_risk_score);
+CREATE INDEX idx_patient_summaries_risk_score ON patient_summaries (latest_risk_score);
+CREATE INDEX idx_patient_summaries_adherence ON patient_summaries (adherence_score);
+CREATE INDEX idx_patient_summaries_er_slope ON patient_summaries (er_slope);
+"""
+
+# Days the ER trend slope is expressed over (percentage points per ER_SLOPE_DAYS)
+ER_SLOPE_DAYS = 30
+
+
+def _run_script(cur, script):
+    # executescript() would commit mid-migration; run the statements one by one instead
+    for statement in script.split(';'):
+        if statement.strip():
+            cur.execute(statement)
+
+
+def _migrate_initial_schema(cur):
+    _run_script(cur, INITIAL_SCHEMA)
+
+
+def _migrate_predictions(cur):
+    # The old demo table (patient_name, result) only ever held one hardcoded row, inserted again on
+    # every rerun. Keep it out of the way under another name rather than dropping anything.
+    columns = [row[1] for row in cur.execute("PRAGMA table_info(predictions)")]
+    if columns:
+        cur.execute("ALTER TABLE predictions RENAME TO legacy_predictions")
+    _run_script(cur, PREDICTIONS_SCHEMA)
+
+
+def _migrate_symptom_severity(cur):
+    # symptom_checks only kept whether a symptom was present; the 0-5 severity is what scoring needs.
+    # Old rows have nothing better than present (0/1) to start from.
+    cur.execute("ALTER TABLE symptom_checks ADD COLUMN severity INTEGER")
+    cur.execute("UPDATE symptom_checks SET severity = present")
+
+
+def _migrate_patient_summaries(cur):
+    _run_script(cur, PATIENT_SUMMARIES_SCHEMA)
+    for (patient_id,) in cur.execute("SELECT id FROM patients").fetchall():
+        _refresh_summary(cur, patient_id)
+
+
+# (user_version, migration) in order; append new ones, never edit applied ones
+MIGRATIONS = (
+    (1, _migrate_initial_schema),
+    (2, _migrate_predictions),
+    (3, _migrate_patient_summaries),
+    (4, _migrate_symptom_severity),
+)
+
+# Biomarker history columns and the table columns they are stored in
+BIOMARKER_COLUMNS = (('ER', 'er'), ('PR', 'pr'), ('HER2', 'her2'), ('confidence', 'confidence'),
+                     ('risk_level', 'risk_level'))
+
+# Risk assessment keys stored as columns; any other entry keys go to details
+RISK_COLUMNS = ('date', 'risk', 'risk_score', 'confidence', 'type')
+
+
+def _timestamp(value=None):
+    """ISO 'YYYY-MM-DD HH:MM:SS' text for a datetime, date or date string (now when None)"""
+    if value is None:
+        value = datetime.datetime.now()
+    elif isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    elif not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+    return value.isoformat(sep=' ', timespec='seconds')
+
+
+def new_patient_key():
+    """Unguessable key for a new session's patient record"""
+    return secrets.token_urlsafe(PATIENT_KEY_BYTES)
+
+
+def is_patient_key(value):
+    """Whether value looks like a key from new_patient_key (and not a short, guessable name)"""
+    return isinstance(value, str) and _PATIENT_KEY_PATTERN.fullmatch(value) is not None
+
+
+def _json_default(value):
+    if isinstance(value, ERResult):
+        return value.to_dict()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _er_slope(dates, values):
+    """Least-squares ER trend in percentage points per ER_SLOPE_DAYS, or None without two dated readings"""
+    days = (np.array(dates, dtype='datetime64[s]') - np.datetime64(dates[0], 's')) / np.timedelta64(1, 'D')
+    if len(days) < 2 or np.ptp(days) == 0:
+        return None
+    values = np.asarray(values, dtype=np.float64)
+    days -= days.mean()
+    return float(np.dot(days, values - values.mean()) / np.dot(days, days) * ER_SLOPE_DAYS)
+
+
+def _refresh_summary(cur, patient_id):
+    """Recompute the patient's patient_summaries row from their risk assessments and biomarker results"""
+    risks = cur.execute("SELECT date, risk, risk_score FROM risk_assessments WHERE patient_id = ? "
+                        "ORDER BY date, id", (patient_id,)).fetchall()
+    readings = cur.execute("SELECT date, er FROM biomarker_results WHERE patient_id = ? AND er IS NOT NULL "
+                           "ORDER BY date, id", (patient_id,)).fetchall()
+
+    # The same adherence figures the patient's own pages show
+    adherence = AdherenceTracker().update(RiskHistory.from_columns([row[0] for row in risks]))
+    latest = risks[-1] if risks else (None, None, None)
+    er_dates, er_values = zip(*readings) if readings else ((), ())
+    cur.execute(
+        "INSERT OR REPLACE INTO patient_summaries (patient_id, name, tests, last_test, next_due, latest_risk, "
+        "latest_risk_score, adherence_score, mean_interval, er_readings, er_latest, er_slope, updated_at) "
+        "SELECT id, name, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ? FROM patients WHERE id = ?",
+        (len(risks), latest[0], adherence.next_due and adherence.next_due.isoformat(), latest[1], latest[2],
+         adherence.score, adherence.mean_interval, len(readings), er_values[-1] if readings else None,
+         _er_slope(er_dates, er_values) if readings else None, _timestamp(), patient_id))
+
+
+class PatientStore:
+    """Typed patient tables in one SQLite file, shared by every session of a process"""
+
+    def __init__(self, path=PATIENT_DB_PATH):
+        self.path = path
+        # One connection per process; the lock serializes its use across Streamlit threads
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.migrate()
+        self.predictions = PredictionRepository(self)
+        self.cohort = CohortRepository(self)
+
+    @property
+    def schema_version(self):
+        with self.lock:
+            return self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def migrate(self):
+        """Apply the migrations this file hasn't seen yet"""
+        for version, migration in MIGRATIONS:
+            if version > self.schema_version:
+                with self.transaction() as cur:
+                    # sqlite3 only opens transactions implicitly for DML; make the DDL atomic too
+                    cur.execute("BEGIN")
+                    migration(cur)
+                    cur.execute(f"PRAGMA user_version = {version}")
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Locked cursor whose statements commit together (or roll back on error)"""
+        with self.lock, self.conn:
+            yield self.conn.cursor()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def find_patient(self, name):
+        """Id of the patient called name, or None if nothing has been recorded for them yet"""
+        with self.lock:
+            row = self.conn.execute("SELECT id FROM patients WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def patient_id(self, name):
+        """Id of the patient called name, created on first use"""
+        with self.transaction() as cur:
+            cur.execute("INSERT OR IGNORE INTO patients (name, created_at) VALUES (?, ?)", (name, _timestamp()))
+            created = cur.rowcount == 1
+            patient_id = cur.execute("SELECT id FROM patients WHERE name = ?", (name,)).fetchone()[0]
+            if created:
+                _refresh_summary(cur, patient_id)
+            return patient_id
+
+    def patients(self):
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT name FROM patients ORDER BY name")]
+
+    # Writes
+
+    def add_risk_assessments(self, patient_id, entries, cur=None):
+        """Insert risk_history entries; keys other than the columns are kept as JSON details"""
+        rows = []
+        for entry in entries:
+            details = {key: value for key, value in entry.items() if key not in RISK_COLUMNS and key != 'score'}
+            rows.append((patient_id, _timestamp(entry.get('date')), entry.get('risk'), entry.get('risk_score'),
+                         entry.get('confidence'), entry.get('type'),
+                         json.dumps(details, default=_json_default) if details else None))
+        with self._cursor(cur) as cur:
+            cur.executemany("INSERT INTO risk_assessments (patient_id, date, risk, risk_score, confidence, type, details) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            _refresh_summary(cur, patient_id)
+
+    def add_biomarker_results(self, patient_id, entries, cur=None):
+        """Insert biomarker_history entries"""
+        rows = [(patient_id, _timestamp(entry.get('date')), *(entry.get(key) for key, _ in BIOMARKER_COLUMNS))
+                for entry in entries]
+        with self._cursor(cur) as cur:
+            cur.executemany("INSERT INTO biomarker_results (patient_id, date, er, pr, her2, confidence, risk_level) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            _refresh_summary(cur, patient_id)
+
+    def add_chat_messages(self, patient_id, messages, cur=None):
+        rows = [(patient_id, _timestamp(message.get('date')), message['role'], message['content'])
+                for message in messages]
+        with self._cursor(cur) as cur:
+            cur.executemany("INSERT INTO chat_messages (patient_id, date, role, content) VALUES (?, ?, ?, ?)", rows)
+
+    def save_family_history(self, patient_id, family_history, cur=None):
+        """Replace the patient's family history factors"""
+        now = _timestamp()
+        with self._cursor(cur) as cur:
+            cur.execute("DELETE FROM family_history WHERE patient_id = ?", (patient_id,))
+            cur.executemany("INSERT INTO family_history (patient_id, factor, present, updated_at) VALUES (?, ?, ?, ?)",
+                            [(patient_id, factor, int(bool(present)), now)
+                             for factor, present in family_history.items()])
+
+    def add_symptom_check(self, patient_id, symptoms, date=None, cur=None):
+        """Record one symptom check ({symptom: severity 0-5})"""
+        date = _timestamp(date)
+        with self._cursor(cur) as cur:
+            cur.executemany("INSERT INTO symptom_checks (patient_id, date, symptom, present, severity) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            [(patient_id, date, symptom, int(bool(severity)), int(severity))
+                             for symptom, severity in symptoms.items()])
+
+    def replace_patient_data(self, patient_id, risk_history=(), biomarker_history=(), family_history=None,
+                             symptoms=None):
+        """Swap all of a patient's records for the given ones in one transaction (backup restore)"""
+        with self.transaction() as cur:
+            for table in ('risk_assessments', 'biomarker_results', 'family_history', 'symptom_checks'):
+                cur.execute(f"DELETE FROM {table} WHERE patient_id = ?", (patient_id,))
+            self.add_risk_assessments(patient_id, risk_history, cur)
+            self.add_biomarker_results(patient_id, biomarker_history, cur)
+            if family_history:
+                self.save_family_history(patient_id, family_history, cur)
+            if symptoms:
+                self.add_symptom_check(patient_id, symptoms, cur=cur)
+            _refresh_summary(cur, patient_id)
+
+    @contextlib.contextmanager
+    def _cursor(self, cur):
+        # Join the caller's transaction, or run in a new one
+        if cur is not None:
+            yield cur
+        else:
+            with self.transaction() as cur:
+                yield cur
+
+    # Reads
+
+    def risk_history(self, patient_id, details=False):
+        """RiskHistory of the patient in date order; details adds the stored extras (er_results ...)"""
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT date, risk, risk_score, confidence, type{', details' if details else ''} "
+                "FROM risk_assessments WHERE patient_id = ? ORDER BY date, id", (patient_id,)).fetchall()
+        columns = list(zip(*rows)) or [()] * (6 if details else 5)
+        extras = [json.loads(value) if value else None for value in columns[5]] if details else None
+        return RiskHistory.from_columns(columns[0], extras=extras, risk=columns[1], risk_score=columns[2],
+                                        confidence=columns[3], type=columns[4])
+
+    def biomarker_history(self, patient_id):
+        """BiomarkerHistory of the patient in date order"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT date, er, pr, her2, confidence, risk_level "
+                "FROM biomarker_results WHERE patient_id = ? ORDER BY date, id", (patient_id,)).fetchall()
+        columns = list(zip(*rows)) or [()] * 6
+        return BiomarkerHistory.from_columns(columns[0], **{key: values for (key, _), values
+                                                            in zip(BIOMARKER_COLUMNS, columns[1:])})
+
+    def biomarker_columns(self, patient_id, after_id=0):
+        """The patient's biomarker rows with id > after_id as typed arrays ('id', 'date', ER ...), in id order"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, date, er, pr, her2, confidence, risk_level FROM biomarker_results "
+                "WHERE patient_id = ? AND id > ? ORDER BY id", (patient_id, after_id)).fetchall()
+        columns = list(zip(*rows)) or [()] * 7
+        arrays = {'id': np.array(columns[0], dtype=np.int64), 'date': np.array(columns[1], dtype='datetime64[s]')}
+        for (key, _), values in zip(BIOMARKER_COLUMNS, columns[2:]):
+            arrays[key] = (np.array([value or '' for value in values], dtype=str) if key in BiomarkerHistory.TEXT
+                           else np.array(values, dtype=np.float64))
+        return arrays
+
+    def count_biomarker_results(self, patient_id, up_to_id=None):
+        with self.lock:
+            if up_to_id is None:
+                return self.conn.execute("SELECT COUNT(*) FROM biomarker_results WHERE patient_id = ?",
+                                         (patient_id,)).fetchone()[0]
+            return self.conn.execute("SELECT COUNT(*) FROM biomarker_results WHERE patient_id = ? AND id <= ?",
+                                     (patient_id, up_to_id)).fetchone()[0]
+
+    def family_history(self, patient_id):
+        with self.lock:
+            return {factor: bool(present) for factor, present in self.conn.execute(
+                "SELECT factor, present FROM family_history WHERE patient_id = ?", (patient_id,))}
+
+    def latest_symptoms(self, patient_id):
+        """The patient's most recent symptom check as {symptom: severity 0-5}"""
+        with self.lock:
+            return {symptom: severity for symptom, severity in self.conn.execute(
+                "SELECT symptom, severity FROM symptom_checks WHERE patient_id = ? AND date = "
+                "(SELECT MAX(date) FROM symptom_checks WHERE patient_id = ?)", (patient_id, patient_id))}
+
+    def chat_history(self, patient_id, limit=None):
+        """The patient's chat messages, oldest first; limit keeps only the most recent ones"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT role, content FROM (SELECT id, role, content FROM chat_messages WHERE patient_id = ? "
+                "ORDER BY date DESC, id DESC LIMIT ?) ORDER BY id", (patient_id, -1 if limit is None else limit)
+            ).fetchall()
+        return [{'role': role, 'content': content} for role, content in rows]
+
+
+class PredictionRepository:
+    """Individual image analysis outcomes in the predictions table"""
+
+    COLUMNS = ('id', 'patient_id', 'date', 'source', 'er_status', 'risk_level', 'risk_score', 'confidence',
+               'er_intensity', 'engine_version')
+
+    def __init__(self, store):
+        self.store = store
+
+    def add_many(self, patient_id, results, source=None, date=None, engine_version=None, cur=None):
+        """Insert one row per ER analysis result, in a single batch"""
+        date = _timestamp(date)
+        rows = [(patient_id, date, source, result['er_status'], result['risk_level'],
+                 result['risk_score'], result['confidence'], result['er_intensity'], engine_version)
+                for result in results]
+        with self.store._cursor(cur) as cur:
+            cur.executemany("INSERT INTO predictions (patient_id, date, source, er_status, risk_level, risk_score, "
+                            "confidence, er_intensity, engine_version) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def count(self, patient_id=None):
+        where, params = self._where(patient_id)
+        with self.store.lock:
+            return self.store.conn.execute(f"SELECT COUNT(*) FROM predictions{where}", params).fetchone()[0]
+
+    def page(self, patient_id=None, page=0, page_size=50):
+        """One page of predictions, newest first, as a list of dicts.
+
+        Ordered by the (patient_id, date) or (date) index, so a page costs
+        page_size rows plus the skipped offset, never a sort of the table.
+        """
+        where, params = self._where(patient_id)
+        with self.store.lock:
+            rows = self.store.conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM predictions{where} "
+                "ORDER BY date DESC, id DESC LIMIT ? OFFSET ?", params + (page_size, page * page_size)).fetchall()
+        return [dict(zip(self.COLUMNS, row)) for row in rows]
+
+    @staticmethod
+    def _where(patient_id):
+        if patient_id is None:
+            return "", ()
+        return " WHERE patient_id = ?", (patient_id,)
+
+
+class CohortRepository:
+    """All patients' pre-aggregated summary rows, sorted, filtered and paged in SQL"""
+
+    # name is left out: it is the patient's record key, which opens their records
+    COLUMNS = ('patient_id', 'tests', 'last_test', 'next_due', 'latest_risk', 'latest_risk_score',
+               'adherence_score', 'mean_interval', 'er_readings', 'er_latest', 'er_slope')
+
+    # Columns a page can be ordered by; each has an index
+    SORT_COLUMNS = ('patient_id', 'last_test', 'next_due', 'latest_risk_score', 'adherence_score', 'er_slope')
+
+    # Overdue status of a summary row on a given day
+    STATUSES = ('No tests', 'Overdue', 'On schedule')
+
+    def __init__(self, store):
+        self.store = store
+
+    def count(self, **filters):
+        where, params = self._where(**filters)
+        with self.store.lock:
+            return self.store.conn.execute(f"SELECT COUNT(*) FROM patient_summaries{where}", params).fetchone()[0]
+
+    def page(self, page=0, page_size=50, sort='patient_id', descending=False, **filters):
+        """One page of summary rows as dicts, with each patient's overdue 'status' added.
+
+        filters are those of _where: risk (latest risk level), status (one
+        of STATUSES), patient_id, include_untested (also list patients
+        without any test, left out by default) and today (the day overdue is
+        judged on, default today).
+        """
+        if sort not in self.SORT_COLUMNS:
+            raise ValueError(f"Cannot sort patients by {sort!r}; choose one of {', '.join(self.SORT_COLUMNS)}")
+        where, params = self._where(**filters)
+        direction = "DESC" if descending else "ASC"
+        with self.store.lock:
+            rows = self.store.conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)}, {self._status_sql()} FROM patient_summaries{where} "
+                f"ORDER BY {sort} {direction}, patient_id {direction} LIMIT ? OFFSET ?",
+                (self._today(filters.get('today')),) + params + (page_size, page * page_size)).fetchall()
+        return [dict(zip(self.COLUMNS + ('status',), row)) for row in rows]
+
+    def risk_levels(self):
+        with self.store.lock:
+            return [row[0] for row in self.store.conn.execute(
+                "SELECT DISTINCT latest_risk FROM patient_summaries WHERE latest_risk IS NOT NULL ORDER BY 1")]
+
+    def refresh(self, patient_ids=None):
+        """Recompute summary rows (all patients by default), e.g. after writing to the tables directly"""
+        with self.store.transaction() as cur:
+            if patient_ids is None:
+                patient_ids = [row[0] for row in cur.execute("SELECT id FROM patients").fetchall()]
+            for patient_id in patient_ids:
+                _refresh_summary(cur, patient_id)
+
+    @staticmethod
+    def _today(today):
+        return (today or datetime.date.today()).isoformat()
+
+    @classmethod
+    def _status_sql(cls):
+        no_tests, overdue, on_schedule = cls.STATUSES
+        return (f"CASE WHEN next_due IS NULL THEN '{no_tests}' WHEN next_due < ? THEN '{overdue}' "
+                f"ELSE '{on_schedule}' END")
+
+    @classmethod
+    def _where(cls, risk=None, status=None, patient_id=None, include_untested=False, today=None):
+        clauses, params = [], []
+        if not include_untested:
+            clauses.append("tests > 0")
+        if risk:
+            clauses.append("latest_risk = ?")
+            params.append(risk)
+        if status == cls.STATUSES[0]:
+            clauses.append("next_due IS NULL")
+        elif status == cls.STATUSES[1]:
+            clauses.append("next_due < ?")
+            params.append(cls._today(today))
+        elif status == cls.STATUSES[2]:
+            clauses.append("next_due >= ?")
+            params.append(cls._today(today))
+        elif status is not None:
+            raise ValueError(f"Unknown status {status!r}; choose one of {', '.join(cls.STATUSES)}")
+        if patient_id is not None:
+            clauses.append("patient_id = ?")
+            params.append(patient_id)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), tuple(params)
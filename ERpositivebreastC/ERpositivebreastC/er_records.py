@@ -0,0 +1,333 @@
+"""Compact typed records for analysis results and the per-session histories.
+
+ERResult is a slotted record of one analysis: plain floats and strings instead
+of a dict of numpy scalars. RiskHistory and BiomarkerHistory keep
+risk_history and biomarker_history column by column, with numeric columns in
+growable float64 arrays and dates as datetime64. The tracker, export and
+report code can then read numeric columns directly instead of reparsing
+strings like "42.0%".
+
+Both still behave like the dicts and lists of dicts they replace
+(result['risk_score'], history[-1]['score'], len(history), iteration), so
+existing pages keep working unchanged.
+"""
+import collections.abc
+import datetime
+import math
+import operator
+
+import numpy as np
+import pandas as pd
+
+
+class ERResult(collections.abc.MutableMapping):
+    """Result of one ER image analysis with dict-style access.
+
+    The eight scoring fields are slots. Anything else a caller attaches
+    (roi, resolution_level, image_name, burst statistics ...) goes into extras.
+    """
+
+    FIELDS = ('er_intensity', 'er_status', 'risk_level', 'risk_score', 'confidence',
+              'color_description', 'avg_red_value', 'color_saturation')
+    NUMERIC_FIELDS = ('er_intensity', 'risk_score', 'confidence', 'avg_red_value', 'color_saturation')
+
+    __slots__ = FIELDS + ('extras',)
+
+    def __init__(self, er_intensity, er_status, risk_level, risk_score, confidence, color_description,
+                 avg_red_value, color_saturation, **extras):
+        self.er_intensity = float(er_intensity)
+        self.er_status = er_status
+        self.risk_level = risk_level
+        self.risk_score = float(risk_score)
+        self.confidence = float(confidence)
+        self.color_description = color_description
+        self.avg_red_value = float(avg_red_value)
+        self.color_saturation = float(color_saturation)
+        self.extras = extras
+
+    def __eq__(self, other):
+        if isinstance(other, collections.abc.Mapping):
+            return self.to_dict() == dict(other)
+        return NotImplemented
+
+    def __getitem__(self, key):
+        if key in ERResult.FIELDS:
+            return getattr(self, key)
+        return self.extras[key]
+
+    def __setitem__(self, key, value):
+        if key in ERResult.NUMERIC_FIELDS:
+            setattr(self, key, float(value))
+        elif key in ERResult.FIELDS:
+            setattr(self, key, value)
+        else:
+            self.extras[key] = value
+
+    def __delitem__(self, key):
+        if key in ERResult.FIELDS:
+            raise KeyError(f"{key} is a required result field")
+        del self.extras[key]
+
+    def __iter__(self):
+        yield from ERResult.FIELDS
+        yield from self.extras
+
+    def __len__(self):
+        return len(ERResult.FIELDS) + len(self.extras)
+
+    def __repr__(self):
+        return f"ERResult({self.to_dict()!r})"
+
+    def __reduce__(self):
+        # Positional values instead of a keyed dict keep pickles small
+        return ERResult, _field_values(self), self.extras
+
+    def __setstate__(self, extras):
+        self.extras = extras
+
+    def to_dict(self):
+        data = dict(zip(ERResult.FIELDS, _field_values(self)))
+        data.update(self.extras)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+_field_values = operator.attrgetter(*ERResult.FIELDS)
+
+
+def _parse_percent(value):
+    """Numeric value of a legacy "42.0%" string (or a number)"""
+    if isinstance(value, str):
+        return float(value.rstrip('%'))
+    return float(value)
+
+
+class ColumnarHistory:
+    """Append-only history stored column by column, with dict-style row access.
+
+    Subclasses name their float64 columns (NUMERIC), text columns (TEXT)
+    and the date format rows are shown with. Any other entry keys are kept
+    per row as extras. Rows are rebuilt as plain dicts on access; missing
+    numeric values are NaN in columns and absent from rows, as they were in
+    the old dicts. version counts appends, so derived data can tell whether
+    it is stale.
+    """
+
+    NUMERIC = ()
+    TEXT = ()
+    DATE_FORMAT = "%Y-%m-%d %H:%M"
+    # numpy datetime unit that prints (with 'T' as a space) in DATE_FORMAT
+    DATE_UNIT = 'm'
+
+    def __init__(self, records=()):
+        self.size = 0
+        self.version = 0
+        self.dates = np.empty(0, dtype='datetime64[s]')
+        self.numeric = {name: np.empty(0, dtype=np.float64) for name in self.NUMERIC}
+        self.text = {name: [] for name in self.TEXT}
+        self.extras = []
+        for record in records:
+            self.append(record)
+
+    def normalize(self, entry):
+        """Hook for subclasses to map legacy entry keys onto columns"""
+        return entry
+
+    def parse_date(self, value):
+        if isinstance(value, datetime.datetime):
+            return value
+        if isinstance(value, datetime.date):
+            return datetime.datetime.combine(value, datetime.time())
+        try:
+            return datetime.datetime.strptime(value, self.DATE_FORMAT)
+        except ValueError:
+            return datetime.datetime.fromisoformat(value)
+
+    def _reserve(self, capacity):
+        if capacity <= len(self.dates):
+            return
+        # Amortized doubling, like list.append
+        new_capacity = max(16, capacity, 2 * len(self.dates))
+        dates = np.empty(new_capacity, dtype='datetime64[s]')
+        dates[:self.size] = self.dates[:self.size]
+        self.dates = dates
+        for name, values in self.numeric.items():
+            grown = np.full(new_capacity, np.nan)
+            grown[:self.size] = values[:self.size]
+            self.numeric[name] = grown
+
+    def append(self, entry=None, **fields):
+        """Add one entry given as a dict and/or keyword arguments"""
+        entry = self.normalize(dict(entry or {}, **fields))
+        self._reserve(self.size + 1)
+
+        self.dates[self.size] = np.datetime64(self.parse_date(entry.pop('date', None) or datetime.datetime.now()), 's')
+        for name in self.NUMERIC:
+            value = entry.pop(name, None)
+            self.numeric[name][self.size] = np.nan if value is None else float(value)
+        for name in self.TEXT:
+            self.text[name].append(entry.pop(name, None))
+        self.extras.append(entry or None)
+        self.size += 1
+        self.version += 1
+
+    def __len__(self):
+        return self.size
+
+    def __bool__(self):
+        return self.size > 0
+
+    def row(self, index):
+        """Entry index as a dict shaped like the original history entries"""
+        row = {'date': self.dates[index].astype(datetime.datetime).strftime(self.DATE_FORMAT)}
+        for name in self.TEXT:
+            if self.text[name][index] is not None:
+                row[name] = self.text[name][index]
+        for name in self.NUMERIC:
+            value = self.numeric[name][index]
+            if not math.isnan(value):
+                row[name] = float(value)
+        if self.extras[index]:
+            row.update(self.extras[index])
+        return row
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.row(i) for i in range(*index.indices(self.size))]
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("history index out of range")
+        return self.row(index)
+
+    def __iter__(self):
+        for index in range(self.size):
+            yield self.row(index)
+
+    def column(self, name, rows=slice(None)):
+        """Read-only view of a date or numeric column, or the list of a text column.
+
+        rows (a slice, e.g. from window()) narrows the view without copying,
+        so columns can go straight into chart traces.
+        """
+        if name == 'date':
+            values = self.dates[:self.size][rows]
+        elif name in self.numeric:
+            values = self.numeric[name][:self.size][rows]
+        else:
+            return self.text[name][:self.size][rows]
+        values = values.view()
+        values.flags.writeable = False
+        return values
+
+    def to_frame(self):
+        """DataFrame with one column per history column, built straight from the arrays"""
+        data = {'date': self.dates[:self.size].astype('datetime64[ns]')}
+        for name in self.TEXT:
+            data[name] = self.text[name]
+        for name in self.NUMERIC:
+            data[name] = self.numeric[name][:self.size]
+        return pd.DataFrame(data)
+
+    def to_records(self):
+        """JSON-ready list of entries, e.g. for export and backups"""
+        # Column-at-a-time conversion; much cheaper than formatting row by row
+        dates = np.datetime_as_string(self.dates[:self.size], unit=self.DATE_UNIT)
+        columns = [(name, self.text[name]) for name in self.TEXT]
+        columns += [(name, self.numeric[name][:self.size].tolist()) for name in self.NUMERIC]
+
+        records = []
+        for index in range(self.size):
+            record = {'date': dates[index].replace('T', ' ')}
+            for name, values in columns:
+                value = values[index]
+                if value is not None and value == value:  # skips NaN
+                    record[name] = value
+            if self.extras[index]:
+                for key, value in self.extras[index].items():
+                    record[key] = value.to_dict() if isinstance(value, ERResult) else _json_ready(value)
+            records.append(record)
+        return records
+
+    @classmethod
+    def from_records(cls, records):
+        return cls(records)
+
+    @classmethod
+    def from_columns(cls, dates, extras=None, **columns):
+        """History built straight from column sequences, e.g. a database query or stored segments.
+
+        dates are datetime64 values, datetimes or ISO strings; numeric
+        columns may hold None for missing values, and columns not given are
+        left empty. Arrays that already have the right dtype (including
+        read-only memory maps) are used without copying; the first append
+        moves them into growable memory.
+        """
+        history = cls()
+        size = len(dates)
+        history.dates = np.asarray(dates, dtype='datetime64[s]')
+        for name in cls.NUMERIC:
+            history.numeric[name] = (np.asarray(columns[name], dtype=np.float64) if name in columns
+                                     else np.full(size, np.nan))
+        for name in cls.TEXT:
+            history.text[name] = list(columns[name]) if name in columns else [None] * size
+        history.extras = list(extras) if extras is not None else [None] * size
+        history.size = size
+        return history
+
+    def window(self, start=None, end=None):
+        """Slice of the rows dated in [start, end), for use with column(name, rows).
+
+        Dates are searched with binary search, so the history has to be in
+        date order, as loaded histories and same-day appends are.
+        """
+        dates = self.dates[:self.size]
+        first = 0 if start is None else int(np.searchsorted(dates, np.datetime64(start, 's'), side='left'))
+        last = self.size if end is None else int(np.searchsorted(dates, np.datetime64(end, 's'), side='left'))
+        return slice(first, last)
+
+
+def _json_ready(value):
+    if isinstance(value, collections.abc.Mapping):
+        return {key: _json_ready(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_ready(item) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class RiskHistory(ColumnarHistory):
+    """risk_history: one row per completed assessment"""
+
+    NUMERIC = ('risk_score', 'confidence')
+    TEXT = ('risk', 'type')
+    DATE_FORMAT = "%Y-%m-%d %H:%M"
+    DATE_UNIT = 'm'
+
+    def normalize(self, entry):
+        # Older entries (and backups) carry preformatted "42.0%" strings
+        if 'score' in entry:
+            entry['risk_score'] = _parse_percent(entry.pop('score'))
+        if isinstance(entry.get('confidence'), str):
+            entry['confidence'] = _parse_percent(entry['confidence'])
+        return entry
+
+    def row(self, index):
+        row = super().row(index)
+        # Display strings the report and summary code still use
+        if 'risk_score' in row:
+            row['score'] = f"{row['risk_score']:.1f}%"
+        return row
+
+
+class BiomarkerHistory(ColumnarHistory):
+    """biomarker_history: one row of ER/PR/HER2 intensities per ER analysis"""
+
+    NUMERIC = ('ER', 'PR', 'HER2', 'confidence')
+    TEXT = ('risk_level',)
+    DATE_FORMAT = "%Y-%m-%d"
+    DATE_UNIT = 'D'
@@ -0,0 +1,218 @@
+"""Content-addressed cache in front of analyze_er_image_with_confidence.
+
+Results are keyed by a SHA-256 of the uploaded image bytes, the calibration
+factor, the analysis options, ANALYSIS_ENGINE_VERSION and the active analysis
+backend, so re-uploads and Streamlit reruns of an already scored photo skip
+decoding and analysis. A bounded in-memory LRU sits in front of an optional
+SQLite tier, which keeps the most recently used max_disk_entries results.
+"""
+import collections
+import concurrent.futures
+import copy
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from er_image_analysis import (
+    ANALYSIS_ENGINE_VERSION,
+    analyze_er_image_with_confidence,
+    calculate_calibration_factor,
+    get_active_backend,
+)
+from er_image_ingest import analysis_max_pixels, decode_bounded_image, load_analysis_image
+from er_records import ERResult
+
+# Results kept in the SQLite tier; the least recently used beyond this are deleted on insert
+ANALYSIS_CACHE_MAX_ROWS = int(os.environ.get("ER_ANALYSIS_CACHE_MAX_ROWS", "10000"))
+
+
+def _to_builtin(value):
+    """Convert numpy scalars to plain Python values so results round-trip through JSON"""
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+
+def make_cache_key(image_bytes, calibration_factor=1.0, **options):
+    """Hash image bytes, calibration factor, options, engine version and backend into a cache key"""
+    digest = hashlib.sha256(image_bytes)
+    digest.update(f"|cal={float(calibration_factor)!r}".encode())
+    for name in sorted(options):
+        digest.update(f"|{name}={options[name]!r}".encode())
+    digest.update(f"|engine={ANALYSIS_ENGINE_VERSION}".encode())
+    # Backends agree on ER status but not bit for bit, so results are kept per backend
+    digest.update(f"|backend={get_active_backend().name}".encode())
+    return digest.hexdigest()
+
+
+class AnalysisResultCache:
+    """Bounded LRU of analysis results with an optional on-disk SQLite tier"""
+
+    def __init__(self, max_entries=256, db_path=None, max_disk_entries=ANALYSIS_CACHE_MAX_ROWS):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.conn = None
+        if db_path:
+            self.conn = sqlite3.connect(db_path, check_same_thread=False)
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS analysis_cache (
+                key TEXT PRIMARY KEY,
+                result TEXT,
+                created TEXT
+            )
+            ''')
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_cache_created ON analysis_cache (created)")
+            self.conn.commit()
+
+    def get(self, key):
+        """Return a fresh ERResult for key, or None"""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.memory_hits += 1
+                return ERResult.from_dict(copy.deepcopy(self.entries[key]))
+
+            if self.conn is not None:
+                row = self.conn.execute("SELECT result FROM analysis_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    result = json.loads(row[0])
+                    self._remember(key, result)
+                    # created doubles as last use, so results still being read survive pruning
+                    self.conn.execute("UPDATE analysis_cache SET created = ? WHERE key = ?", (_now(), key))
+                    self.conn.commit()
+                    self.disk_hits += 1
+                    return ERResult.from_dict(copy.deepcopy(result))
+
+            self.misses += 1
+            return None
+
+    def put(self, key, result):
+        """Store a result under key in memory and, if configured, on disk.
+
+        Entries are kept as plain dicts, the form that round-trips through JSON.
+        """
+        result = {k: _to_builtin(v) for k, v in result.items()}
+        with self.lock:
+            self._remember(key, result)
+            if self.conn is not None:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO analysis_cache (key, result, created) VALUES (?, ?, ?)",
+                    (key, json.dumps(result), _now())
+                )
+                # Walks the created index past the newest max_disk_entries rows; usually finds nothing
+                self.conn.execute(
+                    "DELETE FROM analysis_cache WHERE key IN "
+                    "(SELECT key FROM analysis_cache ORDER BY created DESC, rowid DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries,)
+                )
+                self.conn.commit()
+
+    def _remember(self, key, result):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def analyze(self, image_bytes, calibration_ref=None, max_pixels=None, image=None, **options):
+        """Analyze encoded image bytes, reusing a cached result when one exists.
+
+        The image is decoded at the working resolution (max_pixels, default
+        er_image_ingest.WORKING_MAX_PIXELS), unless the caller already holds
+        that decode and passes it as image. Tiled analyses decode at up to
+        TILED_MAX_PIXELS instead (see decode_bounded_image) and ignore image. options
+        are passed through to analyze_er_image_with_confidence and, with the
+        decode resolution, are part of the key. The returned ERResult is a copy
+        the caller may modify.
+        """
+        tiled = options.get('mode') == "tiled"
+        max_pixels = analysis_max_pixels(options.get('mode'), max_pixels)
+        if tiled:
+            # The caller's image is the working-resolution decode; tiled mode reads a larger one
+            image = None
+        if calibration_ref is not None:
+            calibration_factor = calculate_calibration_factor(None, calibration_ref)
+        else:
+            calibration_factor = 1.0
+
+        # Objects such as calibration profiles contribute their fingerprint, not their repr
+        key_options = {name: value.fingerprint() if hasattr(value, 'fingerprint') else value
+                       for name, value in options.items()}
+        key = make_cache_key(image_bytes, calibration_factor, max_pixels=max_pixels, **key_options)
+        result = self.get(key)
+        if result is not None:
+            return result
+
+        if image is None and tiled:
+            # Tiled analysis crops stripes straight out of the decoded PIL image
+            image = decode_bounded_image(image_bytes, max_pixels)
+        elif image is None:
+            image = load_analysis_image(image_bytes, max_pixels)
+        result = analyze_er_image_with_confidence(image, calibration_ref, **options)
+        self.put(key, result)
+        return result
+
+    def analyze_many(self, images_bytes, calibration_ref=None, max_workers=None, progress=None,
+                     item_options=None, images=None, **options):
+        """Analyze several encoded images concurrently on a bounded thread pool.
+
+        Decoding and the OpenCV/numpy kernels release the GIL, so threads
+        scale with cores. item_options is an optional list of per-image option
+        dicts layered over options, and images an optional list of already
+        decoded working images. Results come back in input order;
+        progress, if given, is called as progress(done, total) from the
+        calling thread.
+        """
+        images_bytes = list(images_bytes)
+        if not images_bytes:
+            return []
+        max_workers = max_workers or min(len(images_bytes), os.cpu_count() or 1)
+
+        results = [None] * len(images_bytes)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {}
+            for idx, image_bytes in enumerate(images_bytes):
+                merged = dict(options, **item_options[idx]) if item_options else options
+                image = images[idx] if images is not None else None
+                futures[pool.submit(self.analyze, image_bytes, calibration_ref, image=image, **merged)] = idx
+            for done, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+                results[futures[future]] = future.result()
+                if progress is not None:
+                    progress(done, len(images_bytes))
+        return results
+
+    def stats(self):
+        """Hit and miss counters for display"""
+        with self.lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                'entries': len(self.entries),
+                'disk_entries': (self.conn.execute("SELECT COUNT(*) FROM analysis_cache").fetchone()[0]
+                                 if self.conn is not None else 0)
+            }
+
+    def clear(self):
+        """Drop all cached results, including the on-disk tier"""
+        with self.lock:
+            self.entries.clear()
+            if self.conn is not None:
+                self.conn.execute("DELETE FROM analysis_cache")
+                self.conn.commit()
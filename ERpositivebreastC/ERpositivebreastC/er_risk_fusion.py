@@ -0,0 +1,215 @@
+"""Multi-factor risk fusion: ER score, symptoms, family history and test frequency.
+
+The scalar functions score one patient from the app's dicts. The batch
+functions score a whole registry at once from columns (NumPy arrays or a
+DataFrame) in a few vectorized passes, for nightly re-scoring.
+
+The batch path repeats the scalar arithmetic operation for operation, in
+the same order, so both give bit-identical scores. The one thing the caller
+has to keep the same is the order of the symptom columns: symptom terms are
+added up in that order, as the scalar function adds them in the order of
+the dict's keys.
+
+Columnar encoding of the dicts:
+- A symptom severity of NaN means the symptom wasn't reported (the key is
+  absent). A row with no reported symptoms at all is an empty dict and
+  scores SYMPTOM_BASELINE.
+- Family flags are truthy or falsy per row; NaN counts as not set.
+"""
+import numpy as np
+import pandas as pd
+
+# Weight of each factor in the composite risk
+ER_WEIGHT = 0.5
+SYMPTOM_WEIGHT = 0.25
+FAMILY_WEIGHT = 0.2
+FREQUENCY_WEIGHT = 0.05
+
+# Symptom risk per symptom at full severity (5); other symptoms don't add to the score
+SYMPTOM_WEIGHTS = {
+    "lumps": 0.3,
+    "skin_changes": 0.2,
+    "nipple_discharge": 0.25,
+    "pain": 0.1,
+    "size_changes": 0.15
+}
+MAX_SEVERITY = 5.0
+
+# Symptom and family scores when nothing was reported
+SYMPTOM_BASELINE = 0.1
+FAMILY_BASELINE = 0.1
+
+# Family history factors and what each adds to FAMILY_BASELINE, in the order they are added
+FAMILY_FACTORS = (
+    ('mother_cancer', 0.3),
+    ('sister_cancer', 0.2),
+    ('brca_positive', 0.4),
+    ('early_onset', 0.2)
+)
+
+# (tests per year, bonus), highest first
+FREQUENCY_BONUSES = ((4, 0.1), (2, 0.05))
+
+# Composite risk below each limit gets that level; anything else (including NaN) is the last level
+RISK_LEVEL_LIMITS = (0.3, 0.6)
+RISK_LEVELS = ("Low Risk", "Moderate Risk", "High Risk")
+RISK_COLORS = ("green", "orange", "red")
+
+
+def multi_factor_risk_fusion(er_results, symptoms_data, family_data, test_frequency):
+    """Advanced multi-factor risk fusion algorithm focused on ER"""
+
+    # ER risk (50% weight) - increased weight since it's the primary focus
+    er_risk = er_results['risk_score'] / 100
+
+    # Symptom risk (25% weight)
+    symptom_risk = calculate_symptom_risk_score(symptoms_data)
+
+    # Family history risk (20% weight)
+    family_risk = calculate_family_risk_modifier(family_data)
+
+    # Test frequency bonus (5% weight)
+    frequency_bonus = calculate_frequency_bonus(test_frequency)
+
+    # Fusion calculation
+    composite_risk = (
+        er_risk * ER_WEIGHT +
+        symptom_risk * SYMPTOM_WEIGHT +
+        family_risk * FAMILY_WEIGHT +
+        frequency_bonus * FREQUENCY_WEIGHT
+    )
+
+    # Determine risk level
+    for limit, level, color in zip(RISK_LEVEL_LIMITS, RISK_LEVELS, RISK_COLORS):
+        if composite_risk < limit:
+            return level, composite_risk * 100, color
+    return RISK_LEVELS[-1], composite_risk * 100, RISK_COLORS[-1]
+
+
+def calculate_symptom_risk_score(symptoms_data):
+    """Calculate normalized symptom risk score"""
+    if not symptoms_data:
+        return SYMPTOM_BASELINE
+
+    total_score = 0
+    for symptom, severity in symptoms_data.items():
+        if symptom in SYMPTOM_WEIGHTS:
+            total_score += SYMPTOM_WEIGHTS[symptom] * (severity / MAX_SEVERITY)
+
+    return min(total_score, 1.0)
+
+
+def calculate_family_risk_modifier(family_data):
+    """Calculate family history risk modifier"""
+    if not family_data:
+        return FAMILY_BASELINE
+
+    risk_score = FAMILY_BASELINE
+    for factor, modifier in FAMILY_FACTORS:
+        if family_data.get(factor, False):
+            risk_score += modifier
+
+    return min(risk_score, 1.0)
+
+
+def calculate_frequency_bonus(test_frequency):
+    """Calculate bonus for regular testing"""
+    for min_tests, bonus in FREQUENCY_BONUSES:
+        if test_frequency >= min_tests:
+            return bonus
+    return 0
+
+
+# Batch scoring
+
+def _column(values, n):
+    return np.broadcast_to(np.asarray(values, dtype=np.float64), (n,))
+
+
+def symptom_risk_scores(symptoms, n):
+    """calculate_symptom_risk_score for n rows; symptoms maps symptom name to severities (NaN: not reported)"""
+    if not symptoms:
+        return np.full(n, SYMPTOM_BASELINE)
+    total = np.zeros(n)
+    reported = np.zeros(n, dtype=bool)
+    for symptom, severities in symptoms.items():
+        severities = _column(severities, n)
+        present = ~np.isnan(severities)
+        reported |= present
+        if symptom in SYMPTOM_WEIGHTS:
+            # Adding 0.0 for unreported symptoms leaves the running sum exactly as the scalar loop has it
+            total += np.where(present, SYMPTOM_WEIGHTS[symptom] * (severities / MAX_SEVERITY), 0.0)
+    return np.where(reported, np.minimum(total, 1.0), SYMPTOM_BASELINE)
+
+
+def family_risk_modifiers(family, n):
+    """calculate_family_risk_modifier for n rows; family maps factor name to per-row flags"""
+    risk = np.full(n, FAMILY_BASELINE)
+    if not family:
+        return risk
+    for factor, modifier in FAMILY_FACTORS:
+        if factor in family:
+            flags = np.broadcast_to(np.asarray(family[factor]), (n,))
+            risk = np.where(flags.astype(bool) & ~pd.isna(flags), risk + modifier, risk)
+    return np.minimum(risk, 1.0)
+
+
+def frequency_bonuses(test_frequency, n):
+    """calculate_frequency_bonus for n rows"""
+    test_frequency = _column(test_frequency, n)
+    bonus = np.zeros(n)
+    # Lowest band first, so higher bands overwrite it
+    for min_tests, value in reversed(FREQUENCY_BONUSES):
+        bonus[test_frequency >= min_tests] = value
+    return bonus
+
+
+def multi_factor_risk_fusion_batch(er_risk_score, symptoms=None, family=None, test_frequency=0):
+    """multi_factor_risk_fusion for every row of columnar inputs.
+
+    er_risk_score holds the ER analyses' risk_score (0-100). symptoms and
+    family map names to per-row columns (dicts of arrays or DataFrames);
+    None scores every row as having reported nothing. test_frequency is
+    per row or one value for all.
+
+    Returns a dict of arrays: 'risk_level', 'risk_score' (composite, 0-100)
+    and 'color'.
+    """
+    er_risk = np.asarray(er_risk_score, dtype=np.float64) / 100
+    n = len(er_risk)
+    composite_risk = (
+        er_risk * ER_WEIGHT +
+        symptom_risk_scores(symptoms, n) * SYMPTOM_WEIGHT +
+        family_risk_modifiers(family, n) * FAMILY_WEIGHT +
+        frequency_bonuses(test_frequency, n) * FREQUENCY_WEIGHT
+    )
+    # Index of the first limit the risk is under; NaN is under none of them
+    levels = np.full(n, len(RISK_LEVEL_LIMITS), dtype=np.intp)
+    for index, limit in reversed(list(enumerate(RISK_LEVEL_LIMITS))):
+        levels[composite_risk < limit] = index
+    return {
+        'risk_level': np.array(RISK_LEVELS, dtype=object)[levels],
+        'risk_score': composite_risk * 100,
+        'color': np.array(RISK_COLORS, dtype=object)[levels]
+    }
+
+
+def score_registry(frame, er_column='er_risk_score', frequency_column='test_frequency', symptom_columns=None):
+    """multi_factor_risk_fusion_batch over a DataFrame with one patient per row.
+
+    Columns named after FAMILY_FACTORS are family flags; symptom_columns
+    (default: every other column except er_column and frequency_column, in
+    frame order) are symptom severities. Returns a DataFrame with
+    risk_level, risk_score and color, on the frame's index.
+    """
+    family_columns = [factor for factor, _ in FAMILY_FACTORS if factor in frame.columns]
+    if symptom_columns is None:
+        symptom_columns = [column for column in frame.columns
+                           if column not in (er_column, frequency_column) and column not in family_columns]
+    scores = multi_factor_risk_fusion_batch(
+        frame[er_column].to_numpy(),
+        symptoms={column: frame[column].to_numpy(dtype=np.float64, na_value=np.nan) for column in symptom_columns},
+        family={column: frame[column].to_numpy() for column in family_columns},
+        test_frequency=frame[frequency_column].to_numpy() if frequency_column in frame.columns else 0
+    )
+    return pd.DataFrame(scores, index=frame.index)
@@ -0,0 +1,138 @@
+"""Append-only columnar segments of biomarker readings, spilled from patients.db.
+
+patients.db stays the record of every ER/PR/HER2 reading. Reading years of
+them back row by row on each session start is the slow part, so a
+patient's readings are also spilled to column segments on disk: one
+directory per segment holding id.npy, date.npy (datetime64), ER.npy,
+PR.npy, HER2.npy, confidence.npy and risk_level.npy.
+
+Loading a patient memory-maps the segments and reads only the rows added
+since the last one from SQLite. Once those reach SEGMENT_ROWS they become
+the next segment, and many small segments are merged into one. With a
+single segment and nothing newer, the BiomarkerHistory columns are the
+memory maps themselves. Chart traces are then read-only slices of the
+files, with no copies; the first append in a session moves the columns
+into memory.
+
+Segments are checked against the database on load. If any covered row
+has been deleted or replaced (e.g. by a backup restore), the patient's
+segments are dropped and rebuilt.
+"""
+import os
+import shutil
+import uuid
+
+import numpy as np
+
+from er_records import BiomarkerHistory
+
+SERIES_DIR = os.environ.get(
+    "ER_SERIES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "biomarker_series"))
+
+# Rows read from SQLite before they are written out as a segment
+SEGMENT_ROWS = int(os.environ.get("ER_SERIES_SEGMENT_ROWS", "1024"))
+
+# Segments per patient before they are merged into one
+MAX_SEGMENTS = 8
+
+SEGMENT_COLUMNS = ('id', 'date') + BiomarkerHistory.NUMERIC + BiomarkerHistory.TEXT
+
+
+class BiomarkerSeriesStore:
+    """Per-patient .npy column segments in front of the biomarker_results table"""
+
+    def __init__(self, patient_store, root=SERIES_DIR, segment_rows=SEGMENT_ROWS, max_segments=MAX_SEGMENTS):
+        self.patient_store = patient_store
+        self.root = root
+        self.segment_rows = segment_rows
+        self.max_segments = max_segments
+
+    def _patient_dir(self, patient_id):
+        return os.path.join(self.root, str(patient_id))
+
+    def segments(self, patient_id):
+        """Segment directories of the patient, oldest first"""
+        directory = self._patient_dir(patient_id)
+        if not os.path.isdir(directory):
+            return []
+        return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+                if name.startswith('seg_') and not name.endswith('.tmp')]
+
+    @staticmethod
+    def read_segment(path):
+        return {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r') for name in SEGMENT_COLUMNS}
+
+    def write_segment(self, patient_id, columns):
+        """Write columns as a new segment, named by its last and first row ids so segments sort in id order"""
+        directory = self._patient_dir(patient_id)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"seg_{int(columns['id'][-1]):012d}_{int(columns['id'][0]):012d}")
+        # Write under a temporary name and rename, so readers never see half a segment. The name is
+        # unique per writer: sessions loading the same patient may write the same segment at once.
+        tmp = f"{path}.{os.getpid()}-{uuid.uuid4().hex}.tmp"
+        os.makedirs(tmp)
+        try:
+            for name in SEGMENT_COLUMNS:
+                np.save(os.path.join(tmp, f"{name}.npy"), np.ascontiguousarray(columns[name]))
+            try:
+                os.replace(tmp, path)
+            except OSError:
+                if not os.path.isdir(path):
+                    raise
+                # Another session wrote the same rows under this name first; use theirs
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        return path
+
+    def clear(self, patient_id):
+        shutil.rmtree(self._patient_dir(patient_id), ignore_errors=True)
+
+    def load(self, patient_id):
+        """BiomarkerHistory of the patient in date order, spilling and compacting segments on the way"""
+        paths = self.segments(patient_id)
+        try:
+            segments = [self.read_segment(path) for path in paths]
+        except FileNotFoundError:
+            # Another session merged the segments while they were listed; list them again
+            paths = self.segments(patient_id)
+            segments = [self.read_segment(path) for path in paths]
+        last_id = int(segments[-1]['id'][-1]) if segments else 0
+        if sum(len(segment['id']) for segment in segments) != self.patient_store.count_biomarker_results(
+                patient_id, up_to_id=last_id):
+            self.clear(patient_id)
+            paths, segments, last_id = [], [], 0
+
+        tail = self.patient_store.biomarker_columns(patient_id, after_id=last_id)
+        if len(tail['id']) >= self.segment_rows:
+            paths.append(self.write_segment(patient_id, tail))
+            segments.append(self.read_segment(paths[-1]))
+            tail = None
+
+        if len(segments) > self.max_segments:
+            merged = _concatenate(segments)
+            stale = paths
+            # Release the memory maps before the files go
+            segments = None
+            path = self.write_segment(patient_id, merged)
+            for old in stale:
+                if old != path:
+                    shutil.rmtree(old, ignore_errors=True)
+            segments = [self.read_segment(path)]
+
+        parts = segments + ([tail] if tail is not None and len(tail['id']) else [])
+        if not parts:
+            return BiomarkerHistory()
+        # A single part is used as-is (memory-mapped when it is a segment)
+        columns = parts[0] if len(parts) == 1 else _concatenate(parts)
+        if len(columns['date']) > 1 and np.any(columns['date'][1:] < columns['date'][:-1]):
+            # Back-dated readings (e.g. restored from a backup) are put in date order
+            order = np.argsort(columns['date'], kind='stable')
+            columns = {name: values[order] for name, values in columns.items()}
+
+        text = {name: [value or None for value in columns[name].tolist()] for name in BiomarkerHistory.TEXT}
+        numeric = {name: columns[name] for name in BiomarkerHistory.NUMERIC}
+        return BiomarkerHistory.from_columns(columns['date'], **numeric, **text)
+
+
+def _concatenate(parts):
+    return {name: np.concatenate([part[name] for part in parts]) for name in SEGMENT_COLUMNS}
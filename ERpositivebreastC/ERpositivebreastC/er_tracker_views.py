@@ -0,0 +1,211 @@
+"""Derived data and figures for the Progress Tracker, reused across reruns.
+
+Streamlit reruns the tracker page on every interaction. It used to rebuild
+DataFrames from the histories, re-parse dates, map risk levels and filter
+one risk level at a time to build traces, all on each rerun. TrackerViews
+lives in st.session_state and remembers which history object and version
+(ColumnarHistory.version counts appends) it last saw:
+
+- Same history, same version: the prepared figures and table are returned
+  as they are.
+- New rows appended: only those rows are folded into the risk level codes
+  and the recent-results list, and then the outputs are rebuilt
+  from them.
+- A different history object (patient switch, restore): everything starts
+  over.
+
+The figures cover a visible date range. They go through er_downsample, so
+long histories are drawn from at most PLOT_MAX_POINTS points per trace; the
+threshold lines and alerts don't depend on the range or the downsampling.
+"""
+import bisect
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from er_downsample import PLOT_MAX_POINTS, downsample, trace_class, trend_trace
+
+# Risk levels drawn on the risk timeline, their y positions and colors
+RISK_LEVELS = {"Low Risk": 1, "Moderate Risk": 2, "High Risk": 3}
+RISK_COLORS = {'Low Risk': 'green', 'Moderate Risk': 'orange', 'High Risk': 'red'}
+
+# Rows in the "Recent Test Results" table
+RECENT_RESULTS = 10
+
+
+class _Derived:
+    """Outputs derived from one history, tagged with the history and version they reflect"""
+
+    def __init__(self, history):
+        self.history = history
+        self.size = 0
+        self.version = None
+        self.outputs = {}
+
+
+class TrackerViews:
+    """Per-session cache of the tracker's derived frames and figures"""
+
+    def __init__(self):
+        self.risk = None
+        self.biomarker = None
+
+    def _sync(self, derived, history, fold):
+        """derived brought up to date with history; fold(derived, start) takes in rows start..size"""
+        if derived is None or derived.history is not history or history.size < derived.size:
+            derived = _Derived(history)
+            fold(derived, None)
+        if derived.version != history.version:
+            fold(derived, derived.size)
+            derived.size = history.size
+            derived.version = history.version
+            derived.outputs = {}
+        return derived
+
+    # Risk history
+
+    @staticmethod
+    def _fold_risk(derived, start):
+        if start is None:
+            derived.codes = []  # RISK_LEVELS value of each row, 0 for other risks
+            derived.recent = []  # (date, row) of the newest rows, oldest first
+            return
+        history = derived.history
+        dates = history.column('date')
+        risks = history.column('risk')
+        for row in range(start, history.size):
+            derived.codes.append(RISK_LEVELS.get(risks[row], 0))
+            bisect.insort(derived.recent, (dates[row], row))
+            if len(derived.recent) > RECENT_RESULTS:
+                derived.recent.pop(0)
+
+    def _risk(self, history):
+        self.risk = self._sync(self.risk, history, self._fold_risk)
+        return self.risk
+
+    def risk_figure(self, history, start=None, end=None):
+        """The "Risk Level Progression" figure over the assessments dated in [start, end)"""
+        derived = self._risk(history)
+        key = (start, end)
+        cached = derived.outputs.get('figure')
+        if cached is None or cached[0] != key:
+            rows = history.window(start, end)
+            dates = history.column('date', rows)
+            codes = np.asarray(derived.codes[rows], dtype=np.float64)
+            codes[codes == 0] = np.nan
+            # Downsampled as one series, so the steps between levels are kept
+            dates, codes = downsample(dates, codes)
+            fig = go.Figure()
+            # Levels in order of first appearance, as the traces were always added
+            names = {value: name for name, value in RISK_LEVELS.items()}
+            for level in pd.unique(codes):
+                name = names[int(level)]
+                points = codes == level
+                fig.add_trace(trace_class(int(points.sum()))(
+                    x=dates[points],
+                    y=codes[points],
+                    mode='markers+lines',
+                    name=name,
+                    marker=dict(color=RISK_COLORS[name], size=10),
+                    line=dict(color=RISK_COLORS[name])
+                ))
+            fig.update_layout(
+                title="Risk Level Progression",
+                xaxis_title="Date",
+                yaxis_title="Risk Level",
+                yaxis=dict(
+                    tickmode='array',
+                    tickvals=[1, 2, 3],
+                    ticktext=['Low Risk', 'Moderate Risk', 'High Risk']
+                ),
+                height=400
+            )
+            derived.outputs['figure'] = (key, fig)
+        return derived.outputs['figure'][1]
+
+    def recent_results(self, history):
+        """The newest RECENT_RESULTS assessments (date, risk, risk_score, type), newest first"""
+        derived = self._risk(history)
+        if 'recent' not in derived.outputs:
+            rows = np.array([row for _, row in reversed(derived.recent)], dtype=np.intp)
+            risks = history.column('risk')
+            types = history.column('type')
+            derived.outputs['recent'] = pd.DataFrame({
+                'date': history.column('date')[rows].astype('datetime64[ns]'),
+                'risk': [risks[row] for row in rows],
+                'risk_score': history.column('risk_score')[rows],
+                'type': [types[row] for row in rows]
+            }, index=rows)
+        return derived.outputs['recent']
+
+    # Biomarker history
+
+    @staticmethod
+    def _fold_biomarker(derived, start):
+        # The chart reads the columns directly; only the version needs tracking
+        return None
+
+    def biomarker_figure(self, history, start=None, end=None):
+        """The "ER Intensity Tracking Over Time" figure over the readings dated in [start, end)"""
+        self.biomarker = derived = self._sync(self.biomarker, history, self._fold_biomarker)
+        key = (start, end)
+        cached = derived.outputs.get('figure')
+        if cached is None or cached[0] != key:
+            derived.outputs['figure'] = (key, build_biomarker_figure(history, history.window(start, end)))
+        return derived.outputs['figure'][1]
+
+
+def build_biomarker_figure(history, rows=slice(None), max_points=PLOT_MAX_POINTS):
+    """ER (plus PR and HER2 when recorded) over the rows of history, with the risk threshold lines"""
+    # Traces start from read-only views of the history's columns and are downsampled when long
+    dates = history.column('date', rows)
+    fig = go.Figure()
+
+    fig.add_trace(trend_trace(
+        dates,
+        history.column('ER', rows),
+        max_points,
+        mode='lines+markers',
+        name='ER Intensity',
+        line=dict(color='#FF6B6B', width=3),
+        marker=dict(size=10)
+    ))
+
+    # Add PR and HER2 traces only if any were recorded
+    for name, color in (('PR', '#4ECDC4'), ('HER2', '#45B7D1')):
+        values = history.column(name, rows)
+        if not np.isnan(values).all():
+            fig.add_trace(trend_trace(
+                dates,
+                values,
+                max_points,
+                mode='lines+markers',
+                name=f'{name} Intensity',
+                line=dict(color=color, width=2),
+                marker=dict(size=8)
+            ))
+
+    # Add threshold lines for ER
+    fig.add_hline(
+        y=50,
+        line_dash="dash",
+        line_color="red",
+        annotation_text="High Risk Threshold (50%)"
+    )
+
+    fig.add_hline(
+        y=20,
+        line_dash="dash",
+        line_color="orange",
+        annotation_text="Moderate Risk Threshold (20%)"
+    )
+
+    fig.update_layout(
+        title="ER Intensity Tracking Over Time",
+        xaxis_title="Date",
+        yaxis_title="ER Intensity (%)",
+        height=400,
+        hovermode='x unified'
+    )
+    return fig
@@ -0,0 +1,105 @@
+"""Per-session cache of decoded uploads and their preview thumbnails.
+
+Streamlit reruns the whole script on every interaction, and each rerun used
+to decode every uploaded photo again for its preview and once more for
+analysis. Entries here are keyed by the uploaded file's id and size, hold the
+working-resolution array from er_image_ingest, and memoize small JPEG
+thumbnails, so previews send kilobytes to the browser and reruns don't
+decode at all. One cache lives in each session's st.session_state.
+"""
+import collections
+import threading
+from io import BytesIO
+
+from PIL import Image
+
+from er_image_ingest import load_analysis_image
+
+# Decoded arrays kept per session; a 3 MP working image is about 9 MB
+UPLOAD_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Longest side of the column previews on the Multi-Image page
+THUMBNAIL_MAX_SIDE = 320
+
+
+class DecodedUpload:
+    """Working-resolution RGB array of one upload plus memoized JPEG thumbnails"""
+
+    def __init__(self, array):
+        self.array = array
+        self.thumbnails = {}
+
+    @property
+    def image(self):
+        """New PIL image copied from the working array; prefer array where a NumPy image will do"""
+        return Image.fromarray(self.array)
+
+    @property
+    def width(self):
+        return self.array.shape[1]
+
+    @property
+    def height(self):
+        return self.array.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.array.nbytes + sum(len(data) for data in self.thumbnails.values())
+
+    def thumbnail(self, max_side=THUMBNAIL_MAX_SIDE, quality=80):
+        """JPEG bytes of the image scaled to fit max_side, encoded once per size"""
+        if max_side not in self.thumbnails:
+            preview = self.image
+            preview.thumbnail((max_side, max_side), Image.Resampling.BILINEAR, reducing_gap=2.0)
+            buffer = BytesIO()
+            preview.save(buffer, format='JPEG', quality=quality)
+            self.thumbnails[max_side] = buffer.getvalue()
+        return self.thumbnails[max_side]
+
+
+class UploadedImageCache:
+    """Byte-bounded LRU of DecodedUpload entries keyed by uploaded file id and size"""
+
+    def __init__(self, max_bytes=UPLOAD_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(uploaded_file):
+        # file_id changes whenever a file is (re)uploaded, even with the same name
+        file_id = getattr(uploaded_file, 'file_id', None) or uploaded_file.name
+        return file_id, uploaded_file.size
+
+    def get(self, uploaded_file):
+        """Return the DecodedUpload for uploaded_file, decoding it only on first use"""
+        key = self.key(uploaded_file)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+
+        entry = DecodedUpload(load_analysis_image(uploaded_file.getvalue()))
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            self._evict()
+        return entry
+
+    def _evict(self):
+        # Always keep the newest entry, even if it alone exceeds the budget
+        while len(self.entries) > 1 and sum(e.nbytes for e in self.entries.values()) > self.max_bytes:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries),
+                'mb': sum(e.nbytes for e in self.entries.values()) / (1024 * 1024)
+            }
@@ -11,12 +11,36 @@ add_statistics_to_main_app()
 
 # Your app logic continues...
 
-import cv2
-CV2_AVAILABLE = True
-except ImportError:
-CV2_AVAILABLE = False
-    print("⚠️ OpenCV not available. Using PIL-based color analysis.")
-    cv2 = None
+import datetime
+import json
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+from PIL import Image
+
+# Image analysis lives in its own module so batch tools share the exact code path
+from er_image_analysis import (
+    ANALYSIS_ENGINE_VERSION,
+    CV2_AVAILABLE,
+    analyze_er_image_with_confidence,
+    calculate_calibration_factor,
+    draw_roi_overlay,
+    get_active_backend,
+    get_multires_report,
+)
+from er_burst_analysis import BURST_TOLERANCE, BurstFrameSource, VideoFrameSource, analyze_burst
+from er_calibration import CalibrationProfileStore, fit_calibration_profile
+from er_upload_cache import UploadedImageCache
+from er_job_queue import AnalysisJobQueue, QueueFullError, report_progress
+from er_patient_store import ER_SLOPE_DAYS, PatientStore, is_patient_key, new_patient_key
+from er_timeseries import BiomarkerSeriesStore
+from er_records import BiomarkerHistory, RiskHistory
+from er_tracker_views import TrackerViews
+from er_downsample import PLOT_MAX_POINTS, trend_trace
+from er_adherence import AdherenceTracker
+from er_risk_fusion import calculate_symptom_risk_score
+from er_result_cache import AnalysisResultCache
 
 # Try to import ReportLab
 try:
@@ -54,6 +78,7 @@ LANGUAGES = {
         "trials": "Clinical Trials",
         "education": "ER+ Education",
         "export": "Data Export",
+        "cohort": "Clinic Dashboard",
         "welcome": "Welcome to ER+ Breast Cancer Risk Monitoring",
         "upload_image": "Upload LFA Test Strip Image",
         "analyze": "Analyze Image",
@@ -77,6 +102,7 @@ LANGUAGES = {
         "trials": "Clinical Trials",
         "education": "ER+ Edukasyon",
         "export": "Data Export",
+        "cohort": "Clinic Dashboard",
         "welcome": "Maligayang pagdating sa ER+ Breast Cancer Risk Monitor",
         "upload_image": "Mag-upload ng LFA Test Strip Image",
         "analyze": "Suriin ang Larawan",
@@ -100,6 +126,7 @@ LANGUAGES = {
         "trials": "Ensayos Clínicos",
         "education": "Educación ER+",
         "export": "Exportar Datos",
+        "cohort": "Panel de la Clínica",
         "welcome": "Bienvenido al Monitor de Riesgo de Cáncer de Mama ER+",
         "upload_image": "Subir Imagen de Tira de Prueba",
         "analyze": "Analizar Imagen",
@@ -112,292 +139,205 @@ LANGUAGES = {
     }
 }
 
+@st.cache_resource
+def get_patient_store():
+    """patients.db with its single connection, opened once per server process"""
+    return PatientStore()
+
+@st.cache_resource
+def get_biomarker_series():
+    """Memory-mapped biomarker column segments in front of patients.db"""
+    return BiomarkerSeriesStore(get_patient_store())
+
+def load_patient_records(patient_name):
+    """Point the session at patient_name and load that patient's records from patients.db.
+
+    Only looks the patient up: a name with nothing recorded yet gets empty
+    records, and its patients row is created by the first write (see
+    session_patient_id), so page loads alone never add rows.
+    """
+    store = get_patient_store()
+    patient_id = store.find_patient(patient_name)
+    st.session_state.patient_name = patient_name
+    st.session_state.patient_id = patient_id
+    if patient_id is None:
+        st.session_state.risk_history = RiskHistory()
+        st.session_state.biomarker_history = BiomarkerHistory()
+        st.session_state.family_history = {}
+        st.session_state.symptoms = {}
+        st.session_state.chat_history = []
+    else:
+        st.session_state.risk_history = store.risk_history(patient_id)
+        st.session_state.biomarker_history = get_biomarker_series().load(patient_id)
+        st.session_state.family_history = store.family_history(patient_id)
+        st.session_state.symptoms = store.latest_symptoms(patient_id)
+        st.session_state.chat_history = store.chat_history(patient_id)
+    dates = st.session_state.risk_history.column('date')
+    st.session_state.last_test_date = str(dates.max().astype('datetime64[D]')) if len(dates) else None
+
+def session_patient_id():
+    """The session patient's id for a write, creating their patients row on the first one"""
+    if st.session_state.patient_id is None:
+        st.session_state.patient_id = get_patient_store().patient_id(st.session_state.patient_name)
+    return st.session_state.patient_id
+
+def record_risk_assessment(entry):
+    """Save a risk_history entry; the session keeps its columns, details stay in patients.db"""
+    get_patient_store().add_risk_assessments(session_patient_id(), [entry])
+    st.session_state.risk_history.append(
+        {key: value for key, value in entry.items() if key == 'date' or key in RiskHistory.NUMERIC
+         or key in RiskHistory.TEXT})
+
+def record_predictions(results, source):
+    """Log each analyzed image's outcome in the predictions table, in one batch"""
+    get_patient_store().predictions.add_many(session_patient_id(), results, source=source,
+                                             engine_version=ANALYSIS_ENGINE_VERSION)
+
+def record_biomarker_result(entry):
+    get_patient_store().add_biomarker_results(session_patient_id(), [entry])
+    st.session_state.biomarker_history.append(entry)
+
+def record_chat_message(message):
+    get_patient_store().add_chat_messages(session_patient_id(), [message])
+    st.session_state.chat_history.append(message)
+
+def save_family_history(family_history):
+    get_patient_store().save_family_history(session_patient_id(), family_history)
+    st.session_state.family_history = family_history
+
+def save_symptoms(symptoms):
+    get_patient_store().add_symptom_check(session_patient_id(), symptoms)
+    st.session_state.symptoms = symptoms
+
+def session_patient_key():
+    """This browser session's patient key, from the page link (?patient=) or newly generated"""
+    patient_key = st.query_params.get("patient")
+    if not is_patient_key(patient_key):
+        patient_key = new_patient_key()
+        st.query_params["patient"] = patient_key
+    return patient_key
+
 # Initialize session state
 if 'language' not in st.session_state:
     st.session_state.language = "English"
-if 'risk_history' not in st.session_state:
-    st.session_state.risk_history = []
-if 'family_history' not in st.session_state:
-    st.session_state.family_history = {}
-if 'symptoms' not in st.session_state:
-    st.session_state.symptoms = []
-if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
-if 'biomarker_history' not in st.session_state:
-    st.session_state.biomarker_history = []
-if 'last_test_date' not in st.session_state:
-    st.session_state.last_test_date = None
-if 'calibration_reference' not in st.session_state:
-    st.session_state.calibration_reference = None
+if 'patient_id' not in st.session_state:
+    # Each session gets its own patient record, kept under the page link so it survives refreshes
+    load_patient_records(session_patient_key())
+if 'calibration_profile' not in st.session_state:
+    st.session_state.calibration_profile = None
+if 'upload_cache' not in st.session_state:
+    st.session_state.upload_cache = UploadedImageCache()
+if 'tracker_views' not in st.session_state:
+    st.session_state.tracker_views = TrackerViews()
+if 'adherence' not in st.session_state:
+    st.session_state.adherence = AdherenceTracker()
 if 'user_location' not in st.session_state:
     st.session_state.user_location = {"city": "", "barangay": ""}
 
-def get_text(key):
-    return LANGUAGES[st.session_state.language].get(key, key)
+@st.cache_resource
+def get_result_cache():
+    """One analysis result cache per server process, persisted next to patients.db"""
+    return AnalysisResultCache(
+        max_entries=256,
+        db_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "analysis_cache.db")
+    )
 
-def analyze_er_image_with_confidence(image, calibration_ref=None):
-    """Enhanced ER analysis with confidence levels for ER+ cancer detection"""
-    img_array = np.array(image)
-    
-    # Color calibration if reference is provided
-    if calibration_ref is not None:
-        calibration_factor = calculate_calibration_factor(img_array, calibration_ref)
-    else:
-        calibration_factor = 1.0
-    
-    if CV2_AVAILABLE and cv2 is not None:
-        # Use OpenCV for color analysis
-        hsv = cv2.cvtColor(img_array, cv2.COLOR_RGB2HSV)
-        
-        # Analyze red spectrum for ER detection
-        lower_red1 = np.array([0, 50, 50])
-        upper_red1 = np.array([10, 255, 255])
-        lower_red2 = np.array([170, 50, 50])
-        upper_red2 = np.array([180, 255, 255])
-        
-        mask1 = cv2.inRange(hsv, lower_red1, upper_red1)
-        mask2 = cv2.inRange(hsv, lower_red2, upper_red2)
-        red_mask = mask1 + mask2
-        
-        # Calculate red intensity
-        total_pixels = img_array.shape[0] * img_array.shape[1]
-        red_pixels = np.sum(red_mask > 0)
-        red_intensity = (red_pixels / total_pixels) * calibration_factor
-        
-        # Calculate average red values for confidence
-        red_areas = img_array[red_mask > 0]
-        if len(red_areas) > 0:
-            avg_red_value = np.mean(red_areas[:, 0])  # R channel
-            color_saturation = np.mean(hsv[red_mask > 0, 1])  # S channel
-        else:
-            avg_red_value = 0
-            color_saturation = 0
-    else:
-        # Fallback PIL-based color analysis when OpenCV is not available
-        # Convert RGB to HSV manually
-        def rgb_to_hsv(rgb):
-            r, g, b = rgb / 255.0
-            max_val = np.maximum(np.maximum(r, g), b)
-            min_val = np.minimum(np.minimum(r, g), b)
-            diff = max_val - min_val
-            
-            # Hue calculation
-            h = np.zeros_like(max_val)
-            mask = diff != 0
-            
-            # Red is max
-            red_mask = (max_val == r) & mask
-            h[red_mask] = (60 * ((g[red_mask] - b[red_mask]) / diff[red_mask]) + 360) % 360
-            
-            # Green is max
-            green_mask = (max_val == g) & mask
-            h[green_mask] = (60 * ((b[green_mask] - r[green_mask]) / diff[green_mask]) + 120) % 360
-            
-            # Blue is max
-            blue_mask = (max_val == b) & mask
-            h[blue_mask] = (60 * ((r[blue_mask] - g[blue_mask]) / diff[blue_mask]) + 240) % 360
-            
-            # Saturation
-            s = np.zeros_like(max_val)
-            s[max_val != 0] = diff[max_val != 0] / max_val[max_val != 0]
-            
-            # Value
-            v = max_val
-            
-            return np.stack([h, s * 255, v * 255], axis=-1)
-        
-        hsv = rgb_to_hsv(img_array.astype(np.float32))
-        
-        # Create red mask using HSV thresholds
-        h = hsv[:, :, 0]
-        s = hsv[:, :, 1]
-        v = hsv[:, :, 2]
-        
-        # Red hue ranges (0-10 and 350-360 degrees, converted to 0-180 scale)
-        red_mask1 = ((h >= 0) & (h <= 10)) & (s >= 50) & (v >= 50)
-        red_mask2 = ((h >= 170) & (h <= 180)) & (s >= 50) & (v >= 50)
-        red_mask = red_mask1 | red_mask2
-        
-        # Also check for high red values in RGB
-        r_channel = img_array[:, :, 0].astype(np.float32)
-        g_channel = img_array[:, :, 1].astype(np.float32)
-        b_channel = img_array[:, :, 2].astype(np.float32)
-        
-        # Red dominance mask (red significantly higher than green and blue)
-        red_dominance = (r_channel > (g_channel + 30)) & (r_channel > (b_channel + 30)) & (r_channel > 100)
-        
-        # Combine masks
-        final_red_mask = red_mask | red_dominance
-        
-        # Calculate red intensity
-        total_pixels = img_array.shape[0] * img_array.shape[1]
-        red_pixels = np.sum(final_red_mask)
-        red_intensity = (red_pixels / total_pixels) * calibration_factor
-        
-        # Calculate average red values for confidence
-        if red_pixels > 0:
-            avg_red_value = np.mean(r_channel[final_red_mask])
-            # Use intensity difference as saturation proxy
-            red_areas = img_array[final_red_mask]
-            color_saturation = np.mean(np.max(red_areas, axis=1) - np.min(red_areas, axis=1)) if len(red_areas) > 0 else 0
-        else:
-            avg_red_value = np.mean(r_channel)  # Use overall red average
-            color_saturation = 50  # Default moderate saturation
-    
-    # Confidence calculation based on color intensity and saturation
-    confidence_factors = []
-    
-    # Factor 1: Red intensity coverage
-    if red_intensity > 0.15:
-        confidence_factors.append(0.95)
-    elif red_intensity > 0.08:
-        confidence_factors.append(0.80)
-    elif red_intensity > 0.02:
-        confidence_factors.append(0.65)
-    else:
-        confidence_factors.append(0.50)
-    
-    # Factor 2: Color saturation
-    if color_saturation > 150:
-        confidence_factors.append(0.90)
-    elif color_saturation > 100:
-        confidence_factors.append(0.75)
-    elif color_saturation > 50:
-        confidence_factors.append(0.60)
-    else:
-        confidence_factors.append(0.40)
-    
-    # Factor 3: Red value intensity
-    if avg_red_value > 200:
-        confidence_factors.append(0.95)
-    elif avg_red_value > 150:
-        confidence_factors.append(0.80)
-    elif avg_red_value > 100:
-        confidence_factors.append(0.65)
-    else:
-        confidence_factors.append(0.45)
-    
-    # Calculate overall confidence
-    confidence = np.mean(confidence_factors)
-    
-    # Determine ER status and risk level based on user specifications
-    if red_intensity < 0.02:
-        er_status = "ER Negative"
-        risk_level = "Low Risk (0-10%)"
-        risk_score = red_intensity * 500  # 0-10%
-        color_description = "No color detected"
-    elif red_intensity < 0.08:
-        er_status = "ER Low Positive"
-        risk_level = "Moderate Risk"
-        risk_score = 30 + (red_intensity - 0.02) * 333  # 30-50%
-        color_description = "Faint red coloration"
-    else:
-        er_status = "ER High Positive"
-        risk_level = "High Risk"
-        risk_score = 60 + (red_intensity - 0.08) * 300  # 60-90%
-        color_description = "Dark red coloration"
-    
-    # Cap risk score at 90%
-    risk_score = min(risk_score, 90)
-    
-    return {
-        'er_intensity': red_intensity * 100,
-        'er_status': er_status,
-        'risk_level': risk_level,
-        'risk_score': risk_score,
-        'confidence': confidence * 100,
-        'color_description': color_description,
-        'avg_red_value': avg_red_value,
-        'color_saturation': color_saturation
-    }
+@st.cache_resource
+def get_analysis_backend():
+    """Pick (or apply the pinned) analysis backend once per server process, at startup"""
+    return get_active_backend()
 
-def calculate_calibration_factor(image, reference_color):
-    """Calculate calibration factor based on reference color"""
-    # Simplified calibration - in practice, would use color science
-    expected_red = [255, 0, 0]  # Expected red reference
-    actual_red = np.mean(reference_color, axis=(0, 1))
-    
-    # Calculate calibration factor
-    factor = np.mean(expected_red) / np.mean(actual_red) if np.mean(actual_red) > 0 else 1.0
-    return np.clip(factor, 0.5, 2.0)  # Limit calibration range
+get_analysis_backend()
 
-def multi_factor_risk_fusion(er_results, symptoms_data, family_data, test_frequency):
-    """Advanced multi-factor risk fusion algorithm focused on ER"""
-    
-    # ER risk (50% weight) - increased weight since it's the primary focus
-    er_risk = er_results['risk_score'] / 100
-    
-    # Symptom risk (25% weight)
-    symptom_risk = calculate_symptom_risk_score(symptoms_data)
-    
-    # Family history risk (20% weight)
-    family_risk = calculate_family_risk_modifier(family_data)
-    
-    # Test frequency bonus (5% weight)
-    frequency_bonus = calculate_frequency_bonus(test_frequency)
-    
-    # Fusion calculation
-    composite_risk = (
-        er_risk * 0.5 +
-        symptom_risk * 0.25 +
-        family_risk * 0.2 +
-        frequency_bonus * 0.05
-    )
-    
-    # Determine risk level
-    if composite_risk < 0.3:
-        return "Low Risk", composite_risk * 100, "green"
-    elif composite_risk < 0.6:
-        return "Moderate Risk", composite_risk * 100, "orange"
-    else:
-        return "High Risk", composite_risk * 100, "red"
-
-def calculate_symptom_risk_score(symptoms_data):
-    """Calculate normalized symptom risk score"""
-    if not symptoms_data:
-        return 0.1
-    
-    risk_weights = {
-        "lumps": 0.3,
-        "skin_changes": 0.2,
-        "nipple_discharge": 0.25,
-        "pain": 0.1,
-        "size_changes": 0.15
-    }
-    
-    total_score = 0
-    for symptom, severity in symptoms_data.items():
-        if symptom in risk_weights:
-            total_score += risk_weights[symptom] * (severity / 5.0)
-    
-    return min(total_score, 1.0)
-
-def calculate_family_risk_modifier(family_data):
-    """Calculate family history risk modifier"""
-    if not family_data:
-        return 0.1
-    
-    risk_score = 0.1
-    
-    if family_data.get('mother_cancer', False):
-        risk_score += 0.3
-    if family_data.get('sister_cancer', False):
-        risk_score += 0.2
-    if family_data.get('brca_positive', False):
-        risk_score += 0.4
-    if family_data.get('early_onset', False):
-        risk_score += 0.2
-    
-    return min(risk_score, 1.0)
-
-def calculate_frequency_bonus(test_frequency):
-    """Calculate bonus for regular testing"""
-    if test_frequency >= 4:  # 4+ times per year
-        return 0.1
-    elif test_frequency >= 2:  # 2-3 times per year
-        return 0.05
+@st.cache_resource
+def get_calibration_store():
+    """Saved calibration profiles, loaded once per server process"""
+    return CalibrationProfileStore()
+
+def get_active_calibration_profile():
+    """The profile selected in this session, with its LUT already built"""
+    if st.session_state.calibration_profile:
+        return get_calibration_store().get(st.session_state.calibration_profile)
+    return None
+
+@st.cache_resource
+def get_job_queue():
+    """Background analysis queue shared by every session of this server process"""
+    return AnalysisJobQueue()
+
+def submit_analysis_job(slot, fn, *args, **kwargs):
+    """Queue an analysis and keep its job id in st.session_state[slot].
+
+    When the queue is full the user is asked to retry instead of the
+    request waiting on a server thread.
+    """
+    try:
+        st.session_state[slot] = get_job_queue().submit(fn, *args, **kwargs)
+    except QueueFullError as e:
+        st.warning(f"⏳ The analysis server is busy ({e.pending} analyses waiting) - please try again in a moment")
+
+@st.fragment(run_every=0.5)
+def show_job_progress(job_id):
+    """Poll a running job; rerun the whole page once it has finished"""
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if job is None or job.done:
+        st.rerun()
+    if job.status == "queued":
+        ahead = queue.position(job_id)
+        st.info(f"⏳ {job.label or 'Analysis'} queued" + (f" - {ahead} ahead of you" if ahead else ""))
     else:
-        return 0
+        st.progress(job.progress, text=f"{job.label or 'Analyzing'}... {job.elapsed:.1f}s")
+
+def take_finished_job(slot):
+    """The finished job in st.session_state[slot], returned once; shows progress until then"""
+    job_id = st.session_state.get(slot)
+    if job_id is None:
+        return None
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if job is None:
+        # Expired before this session came back for it
+        del st.session_state[slot]
+        return None
+    if not job.done:
+        show_job_progress(job_id)
+        return None
+    del st.session_state[slot]
+    queue.discard(job_id)
+    if job.error is not None:
+        st.error(f"❌ {job.label or 'Analysis'} failed: {job.error}")
+        return None
+    return job
+
+def analyze_burst_upload(files, tolerance, calibration_profile=None):
+    """Burst analysis of uploaded (name, bytes) files: the first video if any, else all photos"""
+    videos = [(name, data) for name, data in files if name.lower().endswith(('.mp4', '.mov', '.avi'))]
+    if videos:
+        name, data = videos[0]
+        # cv2.VideoCapture streams from a file path
+        with tempfile.NamedTemporaryFile(suffix=os.path.splitext(name)[1], delete=False) as tmp:
+            tmp.write(data)
+        try:
+            return analyze_burst(VideoFrameSource(tmp.name), tolerance=tolerance, detect_roi=True,
+                                 calibration_profile=calibration_profile)
+        finally:
+            os.unlink(tmp.name)
+    return analyze_burst(BurstFrameSource([data for _, data in files]), tolerance=tolerance, detect_roi=True,
+                         calibration_profile=calibration_profile)
+
+ANALYSIS_MODE_LABELS = {
+    "exact": "Exact (full resolution)",
+    "multires": "Fast (multi-resolution)",
+    "tiled": "High resolution, low memory (tiled)",
+    "profile": "Line profile (T/C ratio)"
+}
+
+# The Clinic Dashboard lists every patient, so it is only offered on staff deployments (ER_STAFF_DASHBOARD=1)
+STAFF_DASHBOARD_ENABLED = os.environ.get("ER_STAFF_DASHBOARD", "").lower() in ("1", "true", "yes")
+
+def get_text(key):
+    return LANGUAGES[st.session_state.language].get(key, key)
 
 def check_test_reminder():
     """Check if user needs a test reminder"""
@@ -409,30 +349,13 @@ def check_test_reminder():
             return True, days_since
     return False, 0
 
+def get_adherence():
+    """The session's AdherenceTracker, caught up with risk_history"""
+    return st.session_state.adherence.update(st.session_state.risk_history)
+
 def get_adherence_score():
     """Calculate adherence score based on testing frequency"""
-    if len(st.session_state.risk_history) < 2:
-        return 0
-    
-    # Calculate average days between tests
-    dates = [datetime.datetime.strptime(r['date'], "%Y-%m-%d %H:%M") for r in st.session_state.risk_history]
-    dates.sort()
-    
-    if len(dates) < 2:
-        return 0
-    
-    intervals = [(dates[i+1] - dates[i]).days for i in range(len(dates)-1)]
-    avg_interval = sum(intervals) / len(intervals)
-    
-    # Score based on ideal 90-day interval
-    if avg_interval <= 90:
-        return 100
-    elif avg_interval <= 120:
-        return 80
-    elif avg_interval <= 180:
-        return 60
-    else:
-        return 40
+    return get_adherence().score
 
 def generate_pdf_report():
     """Generate PDF health report"""
@@ -658,6 +581,14 @@ def get_comprehensive_recommendations(risk_level, confidence, er_results):
 # Sidebar
 st.sidebar.title("🎗️ ER+ Risk Monitor")
 
+def start_new_record():
+    patient_key = new_patient_key()
+    st.query_params["patient"] = patient_key
+    load_patient_records(patient_key)
+
+st.sidebar.caption("👤 Your records are saved under this page's link; bookmark it to come back to them.")
+st.sidebar.button("🆕 Start a new record", on_click=start_new_record)
+
 # Language selector
 selected_language = st.sidebar.selectbox(
     "🌐 Language / Wika / Idioma",
@@ -686,7 +617,7 @@ page = st.sidebar.radio(
         get_text("trials"),
         get_text("education"),
         get_text("export")
-    ]
+    ] + ([get_text("cohort")] if STAFF_DASHBOARD_ENABLED else [])
 )
 
 # Adherence score display
@@ -744,9 +675,11 @@ if page == get_text("home"):
         st.write("- Personalized trend analysis")
         
         if st.session_state.biomarker_history:
-            # Mini biomarker chart
-            df = pd.DataFrame(st.session_state.biomarker_history)
-            fig = px.line(df, x='date', y=['ER', 'PR', 'HER2'], title="Biomarker Trends")
+            # Mini biomarker chart, drawn from the history's columns (downsampled when long)
+            history = st.session_state.biomarker_history
+            fig = go.Figure([trend_trace(history.column('date'), history.column(name), mode='lines', name=name)
+                             for name in ('ER', 'PR', 'HER2')])
+            fig.update_layout(title="Biomarker Trends")
             st.plotly_chart(fig, use_container_width=True)
     
     with feature_tabs[2]:
@@ -776,14 +709,42 @@ elif page == "🔬 Single Image Analyzer":
     
     # Color calibration section
     with st.expander("🎨 Color Calibration (Optional)"):
-        st.write("Upload a reference image with a known red color patch for better accuracy")
+        calibration_store = get_calibration_store()
+        profile_names = calibration_store.names()
+        
+        if profile_names:
+            options = ["None"] + profile_names
+            current = st.session_state.calibration_profile
+            selected_profile = st.selectbox(
+                "Calibration profile",
+                options,
+                index=options.index(current) if current in options else 0,
+                help="Saved per device or lighting setup"
+            )
+            st.session_state.calibration_profile = None if selected_profile == "None" else selected_profile
+        
+        st.write("Upload a reference image with a known red color patch to create a new profile")
         calibration_file = st.file_uploader("Upload Color Reference", type=['png', 'jpg', 'jpeg'], key="single_cal")
         
         if calibration_file:
-            cal_image = Image.open(calibration_file)
-            st.image(cal_image, caption="Calibration Reference", width=200)
-            st.session_state.calibration_reference = cal_image
-            st.success("✅ Calibration reference set!")
+            profile_name = st.text_input("Profile name (e.g. phone model or room)", key="calibration_profile_name")
+            # Profiles are shared by everyone using this server; replacing one changes their analyses too
+            replace = False
+            if profile_name in profile_names:
+                replace = st.checkbox(f"Replace the existing profile '{profile_name}' for everyone using it",
+                                      key="calibration_profile_replace")
+            if st.button("💾 Save Calibration Profile", disabled=not profile_name):
+                cal_image = Image.open(calibration_file).convert('RGB')
+                st.image(cal_image, caption="Calibration Reference", width=200)
+                try:
+                    # Fit once and keep only the profile; the reference image is not held in the session
+                    calibration_store.save(fit_calibration_profile(profile_name, cal_image), replace=replace)
+                except ValueError:
+                    st.error(f"❌ A profile named '{profile_name}' already exists - choose another name "
+                             "or tick the replace box")
+                else:
+                    st.session_state.calibration_profile = profile_name
+                    st.success(f"✅ Calibration profile '{profile_name}' saved and selected!")
     
     # Main image upload
     uploaded_file = st.file_uploader(
@@ -794,109 +755,224 @@ elif page == "🔬 Single Image Analyzer":
     )
     
     if uploaded_file is not None:
-        image = Image.open(uploaded_file)
+        # Decoded once per upload at the analysis working resolution, so ROI boxes line up with what is shown
+        upload = st.session_state.upload_cache.get(uploaded_file)
         
         # Display uploaded image
         st.subheader("📸 Uploaded Image")
-        st.image(image, caption="ER Test Strip", use_container_width=True)
+        st.image(upload.thumbnail(1024), caption="ER Test Strip", use_container_width=True)
+        
+        detect_roi = st.checkbox("🎯 Auto-detect test zone", value=True, key="single_detect_roi",
+                                 help="Analyze only the detected strip instead of the whole photo")
+        analysis_mode = st.radio("Analysis mode", list(ANALYSIS_MODE_LABELS), horizontal=True, key="single_mode",
+                                 format_func=ANALYSIS_MODE_LABELS.get,
+                                 help="Fast mode analyzes a 1/4 scale image and only uses full resolution near the ER cut points; "
+                                      "tiled mode analyzes a higher-resolution decode in stripes with bounded memory; "
+                                      "line profile scores the test/control line ratio")
         
         # Analysis button
         if st.button("🔬 Analyze ER Status", type="primary", key="single_analyze"):
-            with st.spinner("Analyzing ER status..."):
-                # Enhanced ER analysis
-                er_results = analyze_er_image_with_confidence(
-                    image, 
-                    st.session_state.calibration_reference
-                )
-                
-                # Debug information
-                st.write(f"**Debug Info**: OpenCV Available: {CV2_AVAILABLE}")
-                st.write(f"**Image Shape**: {np.array(image).shape}")
-                st.write(f"**Average RGB Values**: R:{np.mean(np.array(image)[:,:,0]):.1f}, G:{np.mean(np.array(image)[:,:,1]):.1f}, B:{np.mean(np.array(image)[:,:,2]):.1f}")
-                
-                # Results section with organized layout
-                st.markdown("---")
-                st.subheader("🎯 ER Analysis Results")
-                
-                # Main results in organized columns
-                result_col1, result_col2, result_col3 = st.columns(3)
-                
-                with result_col1:
-                    risk_color = "red" if "High Risk" in er_results['risk_level'] else "orange" if "Moderate Risk" in er_results['risk_level'] else "green"
-                    st.markdown(f"### Risk Level")
-                    st.markdown(f":{risk_color}[**{er_results['risk_level']}**]")
-                
-                with result_col2:
-                    st.markdown(f"### Risk Score")
-                    st.markdown(f"**{er_results['risk_score']:.1f}%**")
-                
-                with result_col3:
-                    confidence_color = "green" if er_results['confidence'] > 80 else "orange" if er_results['confidence'] > 60 else "red"
-                    st.markdown(f"### Confidence")
-                    st.markdown(f":{confidence_color}[**{er_results['confidence']:.1f}%**]")
-                
-                # Detailed results
-                st.markdown("---")
-                st.subheader("📊 Detailed Analysis")
-                
-                detail_col1, detail_col2 = st.columns(2)
-                
-                with detail_col1:
-                    st.metric("ER Status", er_results['er_status'])
-                    st.metric("Color Intensity", f"{er_results['er_intensity']:.1f}%")
-                    st.write(f"**Color Description**: {er_results['color_description']}")
-                
-                with detail_col2:
-                    st.metric("Average Red Value", f"{er_results['avg_red_value']:.0f}")
-                    st.metric("Color Saturation", f"{er_results['color_saturation']:.0f}")
-                
-                # Comprehensive Recommendations
-                st.markdown("---")
-                st.subheader("📋 Recommendations & Next Steps")
-                
-                recommendations = get_comprehensive_recommendations(
-                    er_results['risk_level'].replace(" (0-10%)", ""), 
-                    er_results['confidence'], 
-                    er_results
-                )
-                
-                # Immediate Actions
-                with st.expander("🚨 Immediate Actions Required", expanded=True):
-                    for action in recommendations["immediate_actions"]:
-                        st.write(f"• {action}")
-                
-                # Medical Facilities
-                with st.expander("🏥 Free & Low-Cost Medical Facilities"):
-                    for facility in recommendations["medical_facilities"]:
-                        st.write(f"**{facility['name']}**")
-                        st.write(f"📞 {facility['phone']} | 💰 {facility['cost']}")
-                        st.write(f"🩺 {facility['services']}")
-                        st.write("---")
-                
-                # Save results
-                result_entry = {
-                    'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
-                    'risk': er_results['risk_level'],
-                    'score': f"{er_results['risk_score']:.1f}%",
-                    'confidence': f"{er_results['confidence']:.1f}%",
-                    'type': 'Single ER Analysis',
-                    'er_results': er_results
-                }
-                st.session_state.risk_history.append(result_entry)
-                st.session_state.last_test_date = datetime.datetime.now().strftime("%Y-%m-%d")
-                
-                # Save ER history
-                er_entry = {
-                    'date': datetime.datetime.now().strftime("%Y-%m-%d"),
-                    'ER': er_results['er_intensity'],
-                    'PR': 0,  # Default value for PR since this is ER-only analysis
-                    'HER2': 0,  # Default value for HER2 since this is ER-only analysis
-                    'risk_level': er_results['risk_level'],
-                    'confidence': er_results['confidence']
-                }
-                st.session_state.biomarker_history.append(er_entry)
-                
-                st.success("✅ Single ER Analysis complete! Results saved.")
+            # Enhanced ER analysis, run as a background job so the page stays responsive
+            # Cached by content, so re-uploads and reruns skip the analysis
+            submit_analysis_job(
+                'single_job', get_result_cache().analyze,
+                uploaded_file.getvalue(),
+                image=upload.array,
+                detect_roi=detect_roi,
+                mode=analysis_mode,
+                calibration_profile=get_active_calibration_profile(),
+                label="Analyzing ER status"
+            )
+        
+        job = take_finished_job('single_job')
+        if job is not None:
+            er_results = job.result
+            
+            if 'roi' in er_results:
+                if er_results['roi'] is not None:
+                    st.image(draw_roi_overlay(upload.array, er_results['roi']), caption="Detected Test Zone",
+                             use_container_width=True)
+                else:
+                    st.warning("⚠️ Could not locate the test strip - analyzed the full image instead")
+            
+            # Debug information
+            st.write(f"**Debug Info**: OpenCV Available: {CV2_AVAILABLE} | "
+                     f"Analysis Backend: {get_analysis_backend().name}")
+            if 'resolution_level' in er_results:
+                multires_report = get_multires_report()
+                st.write(f"**Resolution Used**: 1/{er_results['resolution_level']} | "
+                         f"**Escalations**: {multires_report['escalations']}/{multires_report['analyses']} | "
+                         f"**Est. Time Saved**: {multires_report['estimated_saved_ms']:.0f} ms")
+            if 'tc_ratio' in er_results:
+                st.write(f"**T/C Ratio**: {er_results['tc_ratio']:.3f} | "
+                         f"**Control Peak Area**: {er_results['control_area']:.0f} | "
+                         f"**Test Peak Area**: {er_results['test_area']:.0f}")
+                if er_results['control_area'] == 0:
+                    st.warning("⚠️ No control line found - the test may be invalid")
+            cache_stats = get_result_cache().stats()
+            st.write(f"**Result Cache**: {cache_stats['memory_hits'] + cache_stats['disk_hits']} hits / "
+                     f"{cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%} hit rate), "
+                     f"{cache_stats['disk_entries']} results on disk")
+            image_array = upload.array
+            st.write(f"**Image Shape**: {image_array.shape}")
+            st.write(f"**Average RGB Values**: R:{np.mean(image_array[:,:,0]):.1f}, G:{np.mean(image_array[:,:,1]):.1f}, B:{np.mean(image_array[:,:,2]):.1f}")
+            
+            # Results section with organized layout
+            st.markdown("---")
+            st.subheader("🎯 ER Analysis Results")
+            
+            # Main results in organized columns
+            result_col1, result_col2, result_col3 = st.columns(3)
+            
+            with result_col1:
+                risk_color = "red" if "High Risk" in er_results['risk_level'] else "orange" if "Moderate Risk" in er_results['risk_level'] else "green"
+                st.markdown(f"### Risk Level")
+                st.markdown(f":{risk_color}[**{er_results['risk_level']}**]")
+            
+            with result_col2:
+                st.markdown(f"### Risk Score")
+                st.markdown(f"**{er_results['risk_score']:.1f}%**")
+            
+            with result_col3:
+                confidence_color = "green" if er_results['confidence'] > 80 else "orange" if er_results['confidence'] > 60 else "red"
+                st.markdown(f"### Confidence")
+                st.markdown(f":{confidence_color}[**{er_results['confidence']:.1f}%**]")
+            
+            # Detailed results
+            st.markdown("---")
+            st.subheader("📊 Detailed Analysis")
+            
+            detail_col1, detail_col2 = st.columns(2)
+            
+            with detail_col1:
+                st.metric("ER Status", er_results['er_status'])
+                st.metric("Color Intensity", f"{er_results['er_intensity']:.1f}%")
+                st.write(f"**Color Description**: {er_results['color_description']}")
+            
+            with detail_col2:
+                st.metric("Average Red Value", f"{er_results['avg_red_value']:.0f}")
+                st.metric("Color Saturation", f"{er_results['color_saturation']:.0f}")
+            
+            # Comprehensive Recommendations
+            st.markdown("---")
+            st.subheader("📋 Recommendations & Next Steps")
+            
+            recommendations = get_comprehensive_recommendations(
+                er_results['risk_level'].replace(" (0-10%)", ""), 
+                er_results['confidence'], 
+                er_results
+            )
+            
+            # Immediate Actions
+            with st.expander("🚨 Immediate Actions Required", expanded=True):
+                for action in recommendations["immediate_actions"]:
+                    st.write(f"• {action}")
+            
+            # Medical Facilities
+            with st.expander("🏥 Free & Low-Cost Medical Facilities"):
+                for facility in recommendations["medical_facilities"]:
+                    st.write(f"**{facility['name']}**")
+                    st.write(f"📞 {facility['phone']} | 💰 {facility['cost']}")
+                    st.write(f"🩺 {facility['services']}")
+                    st.write("---")
+            
+            # Save results
+            result_entry = {
+                'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
+                'risk': er_results['risk_level'],
+                'risk_score': er_results['risk_score'],
+                'confidence': er_results['confidence'],
+                'type': 'Single ER Analysis',
+                'er_results': er_results
+            }
+            record_risk_assessment(result_entry)
+            record_predictions([er_results], 'Single ER Analysis')
+            st.session_state.last_test_date = datetime.datetime.now().strftime("%Y-%m-%d")
+            
+            # Save ER history
+            er_entry = {
+                'date': datetime.datetime.now().strftime("%Y-%m-%d"),
+                'ER': er_results['er_intensity'],
+                'PR': 0,  # Default value for PR since this is ER-only analysis
+                'HER2': 0,  # Default value for HER2 since this is ER-only analysis
+                'risk_level': er_results['risk_level'],
+                'confidence': er_results['confidence']
+            }
+            record_biomarker_result(er_entry)
+            
+            st.success("✅ Single ER Analysis complete! Results saved.")
+    
+    # Burst / video capture: several frames of the same strip, read until the estimate is stable
+    st.markdown("---")
+    st.subheader("🎞️ Burst / Video Capture")
+    st.write("*Record a short clip or take several shots of the same strip - frames are analyzed only until the result stabilizes*")
+    burst_files = st.file_uploader(
+        "Upload a short video clip or a burst of photos",
+        type=['mp4', 'mov', 'avi', 'png', 'jpg', 'jpeg'],
+        accept_multiple_files=True,
+        key="burst_upload"
+    )
+    burst_tolerance = st.slider("Stop when risk score and confidence are within ± (%)", 0.25, 5.0,
+                                BURST_TOLERANCE, 0.25, key="burst_tolerance")
+    
+    if burst_files and st.button("🎞️ Analyze Burst", key="burst_analyze"):
+        submit_analysis_job(
+            'burst_job', analyze_burst_upload,
+            [(f.name, f.getvalue()) for f in burst_files],
+            tolerance=burst_tolerance,
+            calibration_profile=get_active_calibration_profile(),
+            label="Analyzing frames"
+        )
+    
+    job = take_finished_job('burst_job')
+    if job is not None:
+        burst_results = job.result
+        burst_col1, burst_col2, burst_col3, burst_col4 = st.columns(4)
+        with burst_col1:
+            # Videos that don't report their length have no frames_available
+            frames_available = burst_results['frames_available']
+            st.metric("Frames Used", f"{burst_results['frames_used']}/"
+                                     f"{'?' if frames_available is None else frames_available}")
+        with burst_col2:
+            st.metric("ER Status", burst_results['er_status'])
+        with burst_col3:
+            st.metric("Risk Score", f"{burst_results['risk_score']:.1f}%")
+        with burst_col4:
+            st.metric("Confidence", f"{burst_results['confidence']:.1f}%")
+        
+        if burst_results['converged']:
+            st.success(f"✅ Result stabilized after {burst_results['frames_used']} frames "
+                       f"(± {burst_results['risk_score_std_error']:.2f}% risk score)")
+        else:
+            st.warning("⚠️ Frames did not agree within the tolerance - consider retaking in steadier light")
+        
+        frame_df = pd.DataFrame(burst_results['frame_scores'])
+        frame_df['Frame'] = range(1, len(frame_df) + 1)
+        frame_df['Running Mean'] = frame_df['risk_score'].expanding().mean()
+        fig = px.line(frame_df, x='Frame', y=['risk_score', 'Running Mean'], markers=True,
+                      title="Risk Score per Analyzed Frame")
+        st.plotly_chart(fig, use_container_width=True)
+        
+        # Save results like a single analysis
+        record_risk_assessment({
+            'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
+            'risk': burst_results['risk_level'],
+            'risk_score': burst_results['risk_score'],
+            'confidence': burst_results['confidence'],
+            'type': 'Burst ER Analysis',
+            'er_results': burst_results
+        })
+        record_predictions([burst_results], 'Burst ER Analysis')
+        st.session_state.last_test_date = datetime.datetime.now().strftime("%Y-%m-%d")
+        record_biomarker_result({
+            'date': datetime.datetime.now().strftime("%Y-%m-%d"),
+            'ER': burst_results['er_intensity'],
+            'PR': 0,
+            'HER2': 0,
+            'risk_level': burst_results['risk_level'],
+            'confidence': burst_results['confidence']
+        })
+
 
 elif page == get_text("analyzer"):
     st.header("📸 Multi-Image ER Analyzer")
@@ -908,127 +984,139 @@ elif page == get_text("analyzer"):
         "Upload multiple ER test strip images for comparison",
         type=['png', 'jpg', 'jpeg'],
         accept_multiple_files=True,
-        help="Upload 2-5 images for comparison analysis"
+        help="Upload two or more images, up to a whole tray of strips"
     )
     
     if uploaded_files:
         st.write(f"Uploaded {len(uploaded_files)} images")
         
-        if len(uploaded_files) > 5:
-            st.warning("⚠️ Please upload maximum 5 images for better analysis")
-            uploaded_files = uploaded_files[:5]
-        
         # Display uploaded images
         cols = st.columns(min(len(uploaded_files), 3))
-        for idx, uploaded_file in enumerate(uploaded_files):
+        # Decoded once per upload and session; previews are small pre-encoded thumbnails
+        uploads = [st.session_state.upload_cache.get(uploaded_file) for uploaded_file in uploaded_files]
+        for idx, upload in enumerate(uploads):
             with cols[idx % 3]:
-                image = Image.open(uploaded_file)
-                st.image(image, caption=f"Image {idx+1}", use_container_width=True)
+                st.image(upload.thumbnail(), caption=f"Image {idx+1}", use_container_width=True)
+        
+        detect_roi = st.checkbox("🎯 Auto-detect test zones", value=True, key="multi_detect_roi",
+                                 help="Analyze only the detected strip in each image")
+        analysis_mode = st.radio("Analysis mode", list(ANALYSIS_MODE_LABELS), horizontal=True, key="multi_mode",
+                                 format_func=ANALYSIS_MODE_LABELS.get)
         
         # Analysis button
         if st.button("🔬 Analyze All ER Images", type="primary"):
-            with st.spinner("Analyzing all ER images..."):
-                results = []
-                
-                # Analyze each image
-                for idx, uploaded_file in enumerate(uploaded_files):
-                    image = Image.open(uploaded_file)
-                    er_results = analyze_er_image_with_confidence(image, st.session_state.calibration_reference)
-                    er_results['image_name'] = f"Image {idx+1}"
-                    results.append(er_results)
-                
-                # Results comparison
-                st.markdown("---")
-                st.subheader("🎯 Multi-Image ER Analysis Results")
-                
-                # Summary table
-                summary_data = []
-                for result in results:
-                    summary_data.append({
-                        'Image': result['image_name'],
-                        'Risk Level': result['risk_level'],
-                        'Risk Score': f"{result['risk_score']:.1f}%",
-                        'Confidence': f"{result['confidence']:.1f}%",
-                        'ER Status': result['er_status'],
-                        'Color Description': result['color_description']
-                    })
-                
-                summary_df = pd.DataFrame(summary_data)
-                st.dataframe(summary_df, use_container_width=True)
-                
-                # Visual comparison
-                st.subheader("📊 Risk Score Comparison")
-                
-                comparison_data = pd.DataFrame({
-                    'Image': [r['image_name'] for r in results],
-                    'Risk Score': [r['risk_score'] for r in results],
-                    'Confidence': [r['confidence'] for r in results]
+            # Analyzed concurrently on a bounded thread pool, as a background job; results come back in upload order
+            submit_analysis_job(
+                'multi_job', get_result_cache().analyze_many,
+                [uploaded_file.getvalue() for uploaded_file in uploaded_files],
+                detect_roi=detect_roi,
+                calibration_profile=get_active_calibration_profile(),
+                images=[upload.array for upload in uploads],
+                mode=analysis_mode,
+                progress=report_progress,
+                label=f"Analyzing {len(uploaded_files)} ER images"
+            )
+        
+        job = take_finished_job('multi_job')
+        if job is not None:
+            results = job.result
+            for idx, er_results in enumerate(results):
+                er_results['image_name'] = f"Image {idx+1}"
+            st.caption(f"Analyzed {len(results)} images in {job.elapsed:.2f}s")
+            
+            # Results comparison
+            st.markdown("---")
+            st.subheader("🎯 Multi-Image ER Analysis Results")
+            
+            # Summary table
+            summary_data = []
+            for result in results:
+                summary_data.append({
+                    'Image': result['image_name'],
+                    'Risk Level': result['risk_level'],
+                    'Risk Score': f"{result['risk_score']:.1f}%",
+                    'Confidence': f"{result['confidence']:.1f}%",
+                    'ER Status': result['er_status'],
+                    'Color Description': result['color_description']
                 })
-                
-                fig = px.bar(comparison_data, x='Image', y='Risk Score', 
-                           color='Risk Score', color_continuous_scale="Reds",
-                           title="ER Risk Score Comparison Across Images")
-                st.plotly_chart(fig, use_container_width=True)
-                
-                # Confidence comparison
-                fig2 = px.bar(comparison_data, x='Image', y='Confidence',
-                            color='Confidence', color_continuous_scale="Blues",
-                            title="Analysis Confidence Comparison")
-                st.plotly_chart(fig2, use_container_width=True)
-                
-                # Overall assessment
-                st.subheader("🔍 Overall Assessment")
-                
-                avg_risk = np.mean([r['risk_score'] for r in results])
-                avg_confidence = np.mean([r['confidence'] for r in results])
-                high_risk_count = sum(1 for r in results if "High Risk" in r['risk_level'])
-                
-                assessment_col1, assessment_col2, assessment_col3 = st.columns(3)
-                
-                with assessment_col1:
-                    st.metric("Average Risk Score", f"{avg_risk:.1f}%")
-                
-                with assessment_col2:
-                    st.metric("Average Confidence", f"{avg_confidence:.1f}%")
-                
-                with assessment_col3:
-                    st.metric("High Risk Images", f"{high_risk_count}/{len(results)}")
-                
-                # Overall recommendation
-                if avg_risk >= 60:
-                    overall_risk = "High Risk"
-                    risk_color = "red"
-                elif avg_risk >= 30:
-                    overall_risk = "Moderate Risk"
-                    risk_color = "orange"
-                else:
-                    overall_risk = "Low Risk"
-                    risk_color = "green"
-                
-                st.markdown(f"### Overall Assessment: :{risk_color}[{overall_risk}]")
-                
-                # Recommendations based on overall assessment
-                recommendations = get_comprehensive_recommendations(
-                    overall_risk, 
-                    avg_confidence, 
-                    {'risk_score': avg_risk, 'confidence': avg_confidence}
-                )
-                
-                # Save best result (highest confidence)
-                best_result = max(results, key=lambda x: x['confidence'])
-                result_entry = {
-                    'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
-                    'risk': overall_risk,
-                    'score': f"{avg_risk:.1f}%",
-                    'confidence': f"{avg_confidence:.1f}%",
-                    'type': 'Multi-Image ER Analysis',
-                    'er_results': best_result,
-                    'total_images': len(results)
-                }
-                st.session_state.risk_history.append(result_entry)
-                st.session_state.last_test_date = datetime.datetime.now().strftime("%Y-%m-%d")
-                
-                st.success(f"✅ Multi-image ER analysis complete! Analyzed {len(results)} images.")
+            
+            summary_df = pd.DataFrame(summary_data)
+            st.dataframe(summary_df, use_container_width=True)
+            
+            # Visual comparison
+            st.subheader("📊 Risk Score Comparison")
+            
+            comparison_data = pd.DataFrame({
+                'Image': [r['image_name'] for r in results],
+                'Risk Score': [r['risk_score'] for r in results],
+                'Confidence': [r['confidence'] for r in results]
+            })
+            
+            fig = px.bar(comparison_data, x='Image', y='Risk Score', 
+                       color='Risk Score', color_continuous_scale="Reds",
+                       title="ER Risk Score Comparison Across Images")
+            st.plotly_chart(fig, use_container_width=True)
+            
+            # Confidence comparison
+            fig2 = px.bar(comparison_data, x='Image', y='Confidence',
+                        color='Confidence', color_continuous_scale="Blues",
+                        title="Analysis Confidence Comparison")
+            st.plotly_chart(fig2, use_container_width=True)
+            
+            # Overall assessment
+            st.subheader("🔍 Overall Assessment")
+            
+            avg_risk = np.mean([r['risk_score'] for r in results])
+            avg_confidence = np.mean([r['confidence'] for r in results])
+            high_risk_count = sum(1 for r in results if "High Risk" in r['risk_level'])
+            
+            assessment_col1, assessment_col2, assessment_col3 = st.columns(3)
+            
+            with assessment_col1:
+                st.metric("Average Risk Score", f"{avg_risk:.1f}%")
+            
+            with assessment_col2:
+                st.metric("Average Confidence", f"{avg_confidence:.1f}%")
+            
+            with assessment_col3:
+                st.metric("High Risk Images", f"{high_risk_count}/{len(results)}")
+            
+            # Overall recommendation
+            if avg_risk >= 60:
+                overall_risk = "High Risk"
+                risk_color = "red"
+            elif avg_risk >= 30:
+                overall_risk = "Moderate Risk"
+                risk_color = "orange"
+            else:
+                overall_risk = "Low Risk"
+                risk_color = "green"
+            
+            st.markdown(f"### Overall Assessment: :{risk_color}[{overall_risk}]")
+            
+            # Recommendations based on overall assessment
+            recommendations = get_comprehensive_recommendations(
+                overall_risk, 
+                avg_confidence, 
+                {'risk_score': avg_risk, 'confidence': avg_confidence}
+            )
+            
+            # Save best result (highest confidence)
+            best_result = max(results, key=lambda x: x['confidence'])
+            result_entry = {
+                'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
+                'risk': overall_risk,
+                'risk_score': avg_risk,
+                'confidence': avg_confidence,
+                'type': 'Multi-Image ER Analysis',
+                'er_results': best_result,
+                'total_images': len(results)
+            }
+            record_risk_assessment(result_entry)
+            record_predictions(results, 'Multi-Image ER Analysis')
+            st.session_state.last_test_date = datetime.datetime.now().strftime("%Y-%m-%d")
+            
+            st.success(f"✅ Multi-image ER analysis complete! Analyzed {len(results)} images.")
 
 elif page == get_text("tracker"):
     st.header("📈 Enhanced Progress Tracker")
@@ -1037,73 +1125,32 @@ elif page == get_text("tracker"):
     if not st.session_state.risk_history:
         st.info("No data to display yet. Complete some assessments first!")
     else:
+        # Long histories get a visible range; the charts draw it downsampled
+        visible_start = visible_end = None
+        histories = [history for history in (st.session_state.risk_history, st.session_state.biomarker_history)
+                     if history]
+        if max(len(history) for history in histories) > PLOT_MAX_POINTS:
+            first = min(history.column('date')[0] for history in histories).astype('datetime64[D]')
+            last = max(history.column('date')[-1] for history in histories).astype('datetime64[D]')
+            if first < last:
+                first, last = first.astype(datetime.datetime), last.astype(datetime.datetime)
+                visible_start, visible_end = st.slider("Visible range", min_value=first, max_value=last,
+                                                       value=(first, last), step=datetime.timedelta(days=1),
+                                                       format="YYYY-MM-DD", key="tracker_visible_range")
+                visible_end += datetime.timedelta(days=1)
+        
         # ER biomarker trends
         if st.session_state.biomarker_history:
             st.subheader("🧬 ER Biomarker Trends Over Time")
             
-            df_bio = pd.DataFrame(st.session_state.biomarker_history)
-            df_bio['date'] = pd.to_datetime(df_bio['date'])
-            
-            # ER-focused chart
-            fig = go.Figure()
-            
-            fig.add_trace(go.Scatter(
-                x=df_bio['date'],
-                y=df_bio['ER'],
-                mode='lines+markers',
-                name='ER Intensity',
-                line=dict(color='#FF6B6B', width=3),
-                marker=dict(size=10)
-            ))
-            
-            # Add PR and HER2 traces only if columns exist
-            if 'PR' in df_bio.columns:
-                fig.add_trace(go.Scatter(
-                    x=df_bio['date'],
-                    y=df_bio['PR'],
-                    mode='lines+markers',
-                    name='PR Intensity',
-                    line=dict(color='#4ECDC4', width=2),
-                    marker=dict(size=8)
-                ))
-            
-            if 'HER2' in df_bio.columns:
-                fig.add_trace(go.Scatter(
-                    x=df_bio['date'],
-                    y=df_bio['HER2'],
-                    mode='lines+markers',
-                    name='HER2 Intensity',
-                    line=dict(color='#45B7D1', width=2),
-                    marker=dict(size=8)
-                ))
-            
-            # Add threshold lines for ER
-            fig.add_hline(
-                y=50,
-                line_dash="dash",
-                line_color="red",
-                annotation_text="High Risk Threshold (50%)"
-            )
-            
-            fig.add_hline(
-                y=20,
-                line_dash="dash",
-                line_color="orange",
-                annotation_text="Moderate Risk Threshold (20%)"
-            )
-            
-            fig.update_layout(
-                title="ER Intensity Tracking Over Time",
-                xaxis_title="Date",
-                yaxis_title="ER Intensity (%)",
-                height=400,
-                hovermode='x unified'
-            )
+            # Figures are rebuilt only when a history has grown or the visible range has moved
+            bio_history = st.session_state.biomarker_history
+            fig = st.session_state.tracker_views.biomarker_figure(bio_history, visible_start, visible_end)
             
             st.plotly_chart(fig, use_container_width=True)
             
             # Alert if ER crosses threshold
-            latest_bio = df_bio.iloc[-1]
+            latest_bio = bio_history[-1]
             if latest_bio['ER'] > 50:
                 st.error(f"⚠️ **High Risk Alert**: ER level is {latest_bio['ER']:.1f}% (above 50% threshold)")
             elif latest_bio['ER'] > 20:
@@ -1114,39 +1161,8 @@ elif page == get_text("tracker"):
         # Overall risk timeline
         st.subheader("📊 Overall Risk Timeline")
         
-        df_risk = pd.DataFrame(st.session_state.risk_history)
-        df_risk['date'] = pd.to_datetime(df_risk['date'])
-        
-        # Risk level mapping
-        risk_mapping = {"Low Risk": 1, "Moderate Risk": 2, "High Risk": 3}
-        df_risk['risk_numeric'] = df_risk['risk'].map(risk_mapping)
-        
-        fig_risk = go.Figure()
-        colors_risk = {'Low Risk': 'green', 'Moderate Risk': 'orange', 'High Risk': 'red'}
-        
-        for risk in df_risk['risk'].unique():
-            if risk in colors_risk:
-                risk_data = df_risk[df_risk['risk'] == risk]
-                fig_risk.add_trace(go.Scatter(
-                    x=risk_data['date'],
-                    y=risk_data['risk_numeric'],
-                    mode='markers+lines',
-                    name=risk,
-                    marker=dict(color=colors_risk[risk], size=10),
-                    line=dict(color=colors_risk[risk])
-                ))
-        
-        fig_risk.update_layout(
-            title="Risk Level Progression",
-            xaxis_title="Date",
-            yaxis_title="Risk Level",
-            yaxis=dict(
-                tickmode='array',
-                tickvals=[1, 2, 3],
-                ticktext=['Low Risk', 'Moderate Risk', 'High Risk']
-            ),
-            height=400
-        )
+        fig_risk = st.session_state.tracker_views.risk_figure(st.session_state.risk_history, visible_start,
+                                                              visible_end)
         
         st.plotly_chart(fig_risk, use_container_width=True)
         
@@ -1155,8 +1171,10 @@ elif page == get_text("tracker"):
         
         col1, col2 = st.columns(2)
         
+        adherence = get_adherence()
+        
         with col1:
-            adherence_score = get_adherence_score()
+            adherence_score = adherence.score
             st.metric("Adherence Score", f"{adherence_score}%")
             
             if adherence_score >= 80:
@@ -1167,18 +1185,39 @@ elif page == get_text("tracker"):
                 st.error("⚠️ Poor adherence - consider setting reminders")
         
         with col2:
-            if st.session_state.last_test_date:
-                last_test = datetime.datetime.strptime(st.session_state.last_test_date, "%Y-%m-%d")
-                days_since = (datetime.datetime.now() - last_test).days
-                next_due = last_test + datetime.timedelta(days=90)
-                
-                st.metric("Days Since Last Test", days_since)
-                st.write(f"Next test due: {next_due.strftime('%Y-%m-%d')}")
+            if adherence.last_test:
+                st.metric("Days Since Last Test", adherence.days_since_last())
+                st.write(f"Next test due: {adherence.next_due.strftime('%Y-%m-%d')}")
+        
+        if adherence.intervals:
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Mean Interval", f"{adherence.mean_interval:.0f} days")
+            col2.metric("Median Interval", f"{adherence.median_interval:.0f} days")
+            col3.metric("Longest Gap", f"{adherence.longest_gap} days")
         
         # Recent results table
         st.subheader("📋 Recent Test Results")
-        display_df = df_risk[['date', 'risk', 'score', 'type']].sort_values('date', ascending=False).head(10)
-        st.dataframe(display_df, use_container_width=True)
+        display_df = st.session_state.tracker_views.recent_results(st.session_state.risk_history)
+        st.dataframe(display_df, use_container_width=True,
+                     column_config={'risk_score': st.column_config.NumberColumn("score", format="%.1f%%")})
+    
+    # Every analyzed image, newest first, read one page at a time from patients.db
+    predictions = get_patient_store().predictions
+    # No patient row yet means nothing logged (and count(None) would count every patient's)
+    prediction_count = (predictions.count(st.session_state.patient_id)
+                        if st.session_state.patient_id is not None else 0)
+    if prediction_count:
+        st.subheader("🗂️ Image Analysis Log")
+        page_size = 25
+        page_count = (prediction_count + page_size - 1) // page_size
+        log_page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, value=1,
+                                   key="prediction_log_page")
+        log_df = pd.DataFrame(predictions.page(st.session_state.patient_id, log_page - 1, page_size))
+        st.dataframe(log_df[['date', 'source', 'er_status', 'risk_level', 'risk_score', 'confidence', 'er_intensity']],
+                     use_container_width=True, hide_index=True,
+                     column_config={'risk_score': st.column_config.NumberColumn("risk score", format="%.1f%%"),
+                                    'confidence': st.column_config.NumberColumn(format="%.1f%%"),
+                                    'er_intensity': st.column_config.NumberColumn("ER intensity", format="%.2f%%")})
 
 elif page == get_text("family"):
     st.header("👨‍👩‍👧‍👦 Enhanced Family History Assessment")
@@ -1244,7 +1283,7 @@ elif page == get_text("family"):
             'lobular_cancer': lobular_cancer
         }
         
-        st.session_state.family_history = family_data
+        save_family_history(family_data)
         
         # Enhanced risk calculation
         risk_score = 0.1  # Base risk
@@ -1424,8 +1463,8 @@ elif page == get_text("symptoms"):
             'menstrual_changes': menstrual_changes
         }
         
-        # Save symptoms to session state
-        st.session_state.symptoms = symptoms_data
+        # Save symptoms to the patient's record
+        save_symptoms(symptoms_data)
         
         # Calculate risk with enhanced factors
         base_risk = calculate_symptom_risk_score(symptoms_data)
@@ -1559,11 +1598,11 @@ elif page == get_text("symptoms"):
         result_entry = {
             'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
             'risk': risk_level,
-            'score': f"{adjusted_risk*100:.1f}%",
+            'risk_score': adjusted_risk * 100,
             'type': 'ER+ Symptom Analysis',
             'symptom_details': symptoms_data
         }
-        st.session_state.risk_history.append(result_entry)
+        record_risk_assessment(result_entry)
         
         st.success("✅ Analysis complete! Results saved to your progress tracker.")
 
@@ -1586,28 +1625,28 @@ elif page == get_text("chat"):
     
     with topic_cols[0]:
         if st.button("💊 Hormone Therapy"):
-            st.session_state.chat_history.append({
+            record_chat_message({
                 'role': 'user',
                 'content': 'Tell me about hormone therapy for ER+ breast cancer'
             })
     
     with topic_cols[1]:
         if st.button("🧬 ER+ Meaning"):
-            st.session_state.chat_history.append({
+            record_chat_message({
                 'role': 'user',
                 'content': 'What does ER+ mean in breast cancer?'
             })
     
     with topic_cols[2]:
         if st.button("📊 Test Results"):
-            st.session_state.chat_history.append({
+            record_chat_message({
                 'role': 'user',
                 'content': 'How to interpret my test results?'
             })
     
     with topic_cols[3]:
         if st.button("🏥 Next Steps"):
-            st.session_state.chat_history.append({
+            record_chat_message({
                 'role': 'user',
                 'content': 'What should I do next?'
             })
@@ -1617,7 +1656,7 @@ elif page == get_text("chat"):
     
     if user_input:
         # Add user message
-        st.session_state.chat_history.append({'role': 'user', 'content': user_input})
+        record_chat_message({'role': 'user', 'content': user_input})
         
         # Enhanced AI responses for ER+ specific topics
         responses = {
@@ -1647,7 +1686,7 @@ elif page == get_text("chat"):
             if latest_risk == "High Risk" and 'next' in user_lower:
                 response += f"\n\nBased on your recent {latest_risk} assessment, I recommend scheduling an appointment with a healthcare provider as soon as possible for proper evaluation."
         
-        st.session_state.chat_history.append({'role': 'assistant', 'content': response})
+        record_chat_message({'role': 'assistant', 'content': response})
         st.rerun()
 
 elif page == get_text("resources"):
@@ -2432,6 +2471,7 @@ elif page == get_text("export"):
             st.subheader("📊 Export Data Files")
             
             # Prepare comprehensive export data
+            adherence = get_adherence()
             export_data = {
                 'user_profile': {
                     'user_id': f"er_plus_user_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}",
@@ -2439,16 +2479,20 @@ elif page == get_text("export"):
                     'app_version': "ER+ Monitor v2.0",
                     'language': st.session_state.language
                 },
-                'risk_assessments': st.session_state.risk_history,
-                'biomarker_history': st.session_state.biomarker_history,
+                'risk_assessments': get_patient_store().risk_history(st.session_state.patient_id, details=True).to_records(),
+                'biomarker_history': st.session_state.biomarker_history.to_records(),
                 'family_history': st.session_state.family_history,
                 'symptoms_history': st.session_state.symptoms,
                 'chat_history': st.session_state.chat_history,
                 'location_data': st.session_state.user_location,
                 'adherence_metrics': {
                     'total_tests': len(st.session_state.risk_history),
-                    'adherence_score': get_adherence_score(),
-                    'last_test_date': st.session_state.last_test_date
+                    'adherence_score': adherence.score,
+                    'last_test_date': st.session_state.last_test_date,
+                    'mean_interval_days': adherence.mean_interval,
+                    'median_interval_days': adherence.median_interval,
+                    'longest_gap_days': adherence.longest_gap,
+                    'next_due_date': str(adherence.next_due) if adherence.next_due else None
                 },
                 'disclaimer': 'This data is for personal health tracking only and does not constitute medical advice. Always consult healthcare professionals for medical decisions.'
             }
@@ -2469,7 +2513,7 @@ elif page == get_text("export"):
             with col2:
                 # CSV export for risk history
                 if st.session_state.risk_history:
-                    df_risk = pd.DataFrame(st.session_state.risk_history)
+                    df_risk = st.session_state.risk_history.to_frame()
                     csv_data = df_risk.to_csv(index=False)
                     
                     st.download_button(
@@ -2481,7 +2525,7 @@ elif page == get_text("export"):
             
             # Biomarker data export
             if st.session_state.biomarker_history:
-                df_bio = pd.DataFrame(st.session_state.biomarker_history)
+                df_bio = st.session_state.biomarker_history.to_frame()
                 bio_csv = df_bio.to_csv(index=False)
                 
                 st.download_button(
@@ -2499,8 +2543,9 @@ elif page == get_text("export"):
                 backup_data = {
                     'backup_date': datetime.datetime.now().isoformat(),
                     'session_state': {
-                        'risk_history': st.session_state.risk_history,
-                        'biomarker_history': st.session_state.biomarker_history,
+                        'risk_history': get_patient_store().risk_history(st.session_state.patient_id,
+                                                                         details=True).to_records(),
+                        'biomarker_history': st.session_state.biomarker_history.to_records(),
                         'family_history': st.session_state.family_history,
                         'symptoms': st.session_state.symptoms,
                         'last_test_date': st.session_state.last_test_date,
@@ -2528,14 +2573,18 @@ elif page == get_text("export"):
                     backup_data = json.load(restore_file)
                     
                     if st.button("🔄 Restore Data", type="secondary"):
-                        # Restore session state
+                        # Replace the patient's stored records, then reload the session from them
                         session_data = backup_data['session_state']
+                        symptoms = session_data.get('symptoms')
                         
-                        st.session_state.risk_history = session_data.get('risk_history', [])
-                        st.session_state.biomarker_history = session_data.get('biomarker_history', [])
-                        st.session_state.family_history = session_data.get('family_history', {})
-                        st.session_state.symptoms = session_data.get('symptoms', [])
-                        st.session_state.last_test_date = session_data.get('last_test_date', None)
+                        get_patient_store().replace_patient_data(
+                            session_patient_id(),
+                            RiskHistory.from_records(session_data.get('risk_history', [])).to_records(),
+                            BiomarkerHistory.from_records(session_data.get('biomarker_history', [])).to_records(),
+                            family_history=session_data.get('family_history', {}),
+                            symptoms=symptoms if isinstance(symptoms, dict) else None
+                        )
+                        load_patient_records(st.session_state.patient_name)
                         st.session_state.user_location = session_data.get('user_location', {"city": "", "barangay": ""})
                         
                         st.success("✅ Data restored successfully!")
@@ -2666,9 +2715,72 @@ elif page == get_text("export"):
             color = 'green' if val == 'Complete' else 'red'
             return f'background-color: {color}; color: white'
         
-        styled_df = completeness_df.style.applymap(color_status, subset=['Status'])
+        styled_df = completeness_df.style.map(color_status, subset=['Status'])
         st.dataframe(styled_df, use_container_width=True)
 
+elif STAFF_DASHBOARD_ENABLED and page == get_text("cohort"):
+    st.header("🏥 Clinic Dashboard")
+    st.write("*Every tested patient in patients.db, with their latest risk, ER trend, adherence and overdue status*")
+    
+    # Summary rows are kept up to date on every write; sorting, filtering and paging run in SQL
+    cohort = get_patient_store().cohort
+    sort_labels = {
+        'patient_id': "Patient",
+        'last_test': "Last test",
+        'next_due': "Next due",
+        'latest_risk_score': "Latest risk score",
+        'adherence_score': "Adherence",
+        'er_slope': "ER trend"
+    }
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        patient_filter = st.number_input("Patient #", min_value=0, value=0, step=1, key="cohort_patient",
+                                         help="Show one patient by number (0 shows all)")
+    with col2:
+        risk_filter = st.selectbox("Latest risk", ["All"] + cohort.risk_levels(), key="cohort_risk")
+    with col3:
+        status_filter = st.selectbox("Status", ("All",) + cohort.STATUSES, key="cohort_status")
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        sort = st.selectbox("Sort by", cohort.SORT_COLUMNS, format_func=sort_labels.get, key="cohort_sort")
+    with col2:
+        descending = st.checkbox("Descending", key="cohort_descending")
+        include_untested = st.checkbox("Include patients without tests", key="cohort_untested")
+    
+    filters = {
+        'patient_id': int(patient_filter) or None,
+        'include_untested': include_untested,
+        'risk': None if risk_filter == "All" else risk_filter,
+        'status': None if status_filter == "All" else status_filter
+    }
+    patient_count = cohort.count(**filters)
+    page_size = 50
+    page_count = max(1, (patient_count + page_size - 1) // page_size)
+    with col3:
+        cohort_page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, value=1,
+                                      key="cohort_page")
+    
+    st.caption(f"{patient_count} patient(s)")
+    rows = cohort.page(cohort_page - 1, page_size, sort=sort, descending=descending, **filters)
+    if rows:
+        cohort_df = pd.DataFrame(rows)
+        st.dataframe(cohort_df[['patient_id', 'status', 'latest_risk', 'latest_risk_score', 'tests', 'last_test',
+                                'next_due', 'adherence_score', 'mean_interval', 'er_latest', 'er_slope']],
+                     use_container_width=True, hide_index=True,
+                     column_config={'patient_id': st.column_config.NumberColumn("patient #", format="%d"),
+                                    'latest_risk': "latest risk",
+                                    'latest_risk_score': st.column_config.NumberColumn("risk score", format="%.1f%%"),
+                                    'adherence_score': st.column_config.NumberColumn("adherence", format="%d%%"),
+                                    'mean_interval': st.column_config.NumberColumn("mean interval (days)",
+                                                                                   format="%.0f"),
+                                    'er_latest': st.column_config.NumberColumn("latest ER", format="%.1f%%"),
+                                    'er_slope': st.column_config.NumberColumn(
+                                        f"ER trend (pts/{ER_SLOPE_DAYS} days)", format="%+.2f")})
+    else:
+        st.info("No patients match these filters.")
+
 # Footer
 st.sidebar.markdown("---")
 st.sidebar.markdown("🎗️ **ER+ Breast Cancer Monitor v2.0**")
@@ -2695,30 +2807,3 @@ if st.sidebar.button("📱 Quick Test Reminder"):
             st.sidebar.success("✅ On schedule")
     else:
         st.sidebar.info("No previous tests recorded")
-import sqlite3
-
-# Connect to database (file will be created)
-conn = sqlite3.connect("patients.db")
-cursor = conn.cursor()
-
-# Create table
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS predictions (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    patient_name TEXT,
-    result TEXT
-)
-''')
-
-# Insert a result
-cursor.execute("INSERT INTO predictions (patient_name, result) VALUES (?, ?)", 
-               ("Patient 1", "HER2+ Luminal B"))
-conn.commit()
-
-# Show all predictions
-cursor.execute("SELECT * FROM predictions")
-print("Stored predictions:")
-for row in cursor.fetchall():
-    print(row)
-
-conn.close()